@@ -0,0 +1,98 @@
+import threading
+from collections import OrderedDict
+
+from utils.PromptRegistry import estimate_tokens
+
+
+def _clip(text, max_chars):
+    text = " ".join((text or "").split())
+    return text if len(text) <= max_chars else text[:max_chars] + "…"
+
+
+class _Session:
+    __slots__ = ("turns", "summary")
+
+    def __init__(self):
+        self.turns = []
+        self.summary = []
+
+
+class ConversationMemory:
+    """
+    服务端的对话记忆（按用户保存）
+
+    最近的对话原样保留，超出 recent_turns 轮或 token_budget 的较早对话被压缩成滚动摘要
+    （每轮只保留用户请求和回答开头的一小段），摘要本身也有 token 上限，超出时丢弃最早的部分。
+    context() 返回的文本注入 query_gen 和 conclude 的提示词，无论会话多长都不超过 token_budget，
+    客户端不需要重复发送历史记录。只保存在内存中，最多保留 max_sessions 个用户（LRU）。
+    """
+
+    def __init__(self, token_budget=800, recent_turns=4, summary_budget=300, max_sessions=1000,
+                 summary_chars=40):
+        self.token_budget = token_budget
+        self.recent_turns = recent_turns
+        self.summary_budget = min(summary_budget, token_budget)
+        self.max_sessions = max_sessions
+        self.summary_chars = summary_chars
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+
+    def _session(self, user_name):
+        session = self._sessions.get(user_name)
+        if session is None:
+            session = self._sessions[user_name] = _Session()
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        else:
+            self._sessions.move_to_end(user_name)
+        return session
+
+    def _summarize(self, user_message, assistant_message):
+        return (f"用户：{_clip(user_message, self.summary_chars)} → "
+                f"助手：{_clip(assistant_message, self.summary_chars)}")
+
+    @staticmethod
+    def _format_turn(user_message, assistant_message):
+        return f"用户：{user_message}\n助手：{assistant_message}"
+
+    def _compact(self, session):
+        # 原样保留的部分不超过 recent_turns 轮，且与摘要合计不超过 token_budget
+        def verbatim_tokens():
+            return sum(estimate_tokens(self._format_turn(*turn)) for turn in session.turns)
+
+        while session.turns and (len(session.turns) > self.recent_turns or
+                                 verbatim_tokens() > self.token_budget - self.summary_budget):
+            session.summary.append(self._summarize(*session.turns.pop(0)))
+        while session.summary and sum(estimate_tokens(line) for line in session.summary) > self.summary_budget:
+            session.summary.pop(0)
+
+    def add_turn(self, user_name, user_message, assistant_message):
+        if not user_name:
+            return
+        with self._lock:
+            session = self._session(user_name)
+            session.turns.append((user_message or "", assistant_message or ""))
+            self._compact(session)
+
+    def context(self, user_name):
+        """
+        返回注入提示词的对话上下文（没有历史时为空字符串）
+        """
+        if not user_name:
+            return ""
+        with self._lock:
+            session = self._sessions.get(user_name)
+            if session is None:
+                return ""
+            summary = list(session.summary)
+            turns = list(session.turns)
+        parts = []
+        if summary:
+            parts.append("较早的对话摘要：\n" + "\n".join(summary))
+        if turns:
+            parts.append("最近的对话：\n" + "\n".join(self._format_turn(*turn) for turn in turns))
+        return "\n".join(parts)
+
+    def clear(self, user_name):
+        with self._lock:
+            self._sessions.pop(user_name, None)
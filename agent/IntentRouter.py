@@ -0,0 +1,206 @@
+import argparse
+import json
+import math
+import os
+import random
+import re
+from collections import Counter
+
+INTENT_RECORD = "record"
+INTENT_QUERY = "query"
+INTENT_ADVICE = "advice"
+INTENT_LOGIN = "login"
+INTENTS = [INTENT_RECORD, INTENT_QUERY, INTENT_ADVICE, INTENT_LOGIN]
+
+DEFAULT_MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "intent_model.json")
+
+# (意图, 正则, 权重)
+DEFAULT_RULES = [
+    (INTENT_LOGIN, re.compile(r"^\s*(登录|登陆|注册)"), 3.0),
+    # "我是张三" 只有后面紧跟一个简短的名字并结束时才是登录，"我是不是吃太多肉了" 这类疑问句不算
+    (INTENT_LOGIN, re.compile(
+        r"^\s*(我是|我叫|用户名(是|为)?)(?!不是|否|.*[吗呢])\s*[:：]?\s*[A-Za-z0-9_\u4e00-\u9fff]{1,16}\s*[。！!]?\s*$"
+    ), 3.0),
+    (INTENT_QUERY, re.compile(r"(吃了|吃过|喝了|吃的).*(什么|哪些|啥|多少)"), 2.0),
+    (INTENT_QUERY, re.compile(r"(查询|查一下|查看|记录了|饮食报告|报告|统计|总结)"), 1.5),
+    (INTENT_ADVICE, re.compile(r"(建议|应该|补充|营养|健康|搭配|推荐|评估|怎么吃|优化|合理)"), 1.5),
+    (INTENT_RECORD, re.compile(r"(早餐|早饭|午餐|午饭|晚餐|晚饭|加餐|夜宵|零食|下午茶|早上|中午|晚上)"), 0.5),
+    (INTENT_RECORD, re.compile(r"(吃了|喝了|吃的是|记录)"), 1.0),
+    # "早餐燕麦粥，午餐西红柿炒鸡蛋" 这类直接列出每餐食物的写法
+    (INTENT_RECORD, re.compile(r"(早餐|早饭|午餐|午饭|晚餐|晚饭|加餐|夜宵)(是|[:：])?[\u4e00-\u9fff]"), 1.0),
+]
+QUESTION_PATTERN = re.compile(r"(什么|哪些|啥|吗|呢|多少|怎么|如何|[?？])")
+# 否定和计划中的用餐（"早餐没吃饭"、"晚餐打算吃鱼"、"明天早餐吃包子"）不是已经发生的记录
+NOT_EATEN_PATTERN = re.compile(r"(没|不|别|未|想|要|打算|准备|计划|待会|等会|一会|明天|后天|明早|明晚|下周|下次)")
+
+
+class RuleClassifier:
+    """基于关键词/正则的意图分类器"""
+
+    def __init__(self, rules=None):
+        self.rules = rules if rules is not None else DEFAULT_RULES
+
+    def classify(self, text):
+        scores = Counter()
+        for intent, pattern, weight in self.rules:
+            if pattern.search(text):
+                scores[intent] += weight
+        # 记录类规则只对已经发生的陈述句有效，疑问句里的"吃了"通常是查询
+        if scores[INTENT_RECORD] and (QUESTION_PATTERN.search(text) or NOT_EATEN_PATTERN.search(text)):
+            del scores[INTENT_RECORD]
+        if not scores:
+            return None, 0.0
+        intent, best = scores.most_common(1)[0]
+        total = sum(scores.values())
+        # 只命中一类规则时置信度由权重决定，多类冲突时按占比折算
+        confidence = min(best, 2.0) / 2.0 * (best / total)
+        return intent, round(confidence, 4)
+
+
+class NgramModel:
+    """
+    字符 n-gram 逻辑回归（softmax）意图模型
+
+    纯Python实现，模型以JSON形式保存在磁盘上，加载后预测只需要查表和一次softmax。
+    """
+
+    def __init__(self, labels=None, weights=None, bias=None, ngram_range=(1, 3)):
+        self.labels = labels or list(INTENTS)
+        self.weights = weights or {}
+        self.bias = bias or [0.0] * len(self.labels)
+        self.ngram_range = tuple(ngram_range)
+
+    def _features(self, text):
+        text = re.sub(r"\s+", "", text)
+        features = Counter()
+        low, high = self.ngram_range
+        for n in range(low, high + 1):
+            for i in range(len(text) - n + 1):
+                features[text[i:i + n]] += 1
+        return features
+
+    def _scores(self, features):
+        scores = list(self.bias)
+        for feature, count in features.items():
+            weight = self.weights.get(feature)
+            if weight is None:
+                continue
+            for k in range(len(scores)):
+                scores[k] += weight[k] * count
+        top = max(scores)
+        exps = [math.exp(s - top) for s in scores]
+        total = sum(exps)
+        return [e / total for e in exps]
+
+    def predict(self, text):
+        probs = self._scores(self._features(text))
+        best = max(range(len(probs)), key=probs.__getitem__)
+        return self.labels[best], round(probs[best], 4)
+
+    def fit(self, samples, epochs=20, lr=0.5, l2=1e-4, seed=0):
+        """
+        训练模型
+
+        参数:
+            samples (list): (文本, 意图) 列表
+            epochs (int): 训练轮数
+            lr (float): 学习率
+            l2 (float): L2正则系数
+        """
+        data = [(self._features(text), self.labels.index(intent)) for text, intent in samples]
+        rng = random.Random(seed)
+        for _ in range(epochs):
+            rng.shuffle(data)
+            for features, target in data:
+                probs = self._scores(features)
+                for k in range(len(probs)):
+                    grad = probs[k] - (1.0 if k == target else 0.0)
+                    self.bias[k] -= lr * grad
+                    for feature, count in features.items():
+                        weight = self.weights.setdefault(feature, [0.0] * len(self.labels))
+                        weight[k] -= lr * (grad * count + l2 * weight[k])
+        return self
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({
+                "labels": self.labels,
+                "ngram_range": list(self.ngram_range),
+                "bias": self.bias,
+                "weights": {k: [round(w, 6) for w in v] for k, v in self.weights.items()},
+            }, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(labels=data["labels"], weights=data["weights"], bias=data["bias"],
+                   ngram_range=data.get("ngram_range", (1, 3)))
+
+
+class IntentRouter:
+    """
+    本地意图路由
+
+    先用规则判断，规则置信度不足时再使用磁盘上的 n-gram 模型（如果存在），
+    两者都低于阈值时返回 None，由调用方回退到大模型判断。
+    可以通过实现同样的 classify(text) -> (intent, confidence, source) 接口替换。
+    """
+
+    def __init__(self, model_path=DEFAULT_MODEL_PATH, threshold=0.6, rules=None):
+        self.threshold = threshold
+        self.rules = RuleClassifier(rules)
+        self.model = NgramModel.load(model_path) if model_path and os.path.exists(model_path) else None
+
+    def classify(self, text):
+        """
+        判断用户输入的意图
+
+        返回:
+            tuple: (意图或None, 置信度, 来源 "rule"/"model"/"none")
+        """
+        text = text or ""
+        intent, confidence = self.rules.classify(text)
+        if intent is not None and confidence >= self.threshold:
+            return intent, confidence, "rule"
+        if self.model is not None:
+            model_intent, model_confidence = self.model.predict(text)
+            if model_confidence >= self.threshold:
+                return model_intent, model_confidence, "model"
+        return None, confidence, "none"
+
+
+def load_samples(path, rules=None, threshold=0.6):
+    """
+    读取训练数据（JSONL，每行包含 text 和可选的 intent）
+
+    没有标注 intent 的请求用规则分类器自动标注，置信度不足的行会被跳过，
+    因此可以直接用记录下来的历史请求训练。
+    """
+    classifier = RuleClassifier(rules)
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            text = item.get("text") or item.get("require") or ""
+            intent = item.get("intent")
+            if intent is None:
+                intent, confidence = classifier.classify(text)
+                if intent is None or confidence < threshold:
+                    continue
+            if intent in INTENTS:
+                yield text, intent
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="训练本地意图分类模型")
+    parser.add_argument("data", help="训练数据JSONL文件，每行 {\"text\": ..., \"intent\": ...}")
+    parser.add_argument("--output", default=DEFAULT_MODEL_PATH, help="模型输出路径")
+    parser.add_argument("--epochs", type=int, default=20)
+    args = parser.parse_args()
+
+    samples = list(load_samples(args.data))
+    NgramModel().fit(samples, epochs=args.epochs).save(args.output)
+    print(f"已使用 {len(samples)} 条样本训练意图模型，保存到 {args.output}")
@@ -1,8 +1,9 @@
 from langchain_core.language_models import BaseChatModel
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.prompts import ChatPromptTemplate, HumanMessagePromptTemplate
 from typing import Any
 
+from utils.PromptRegistry import prompt_registry
+
 
 class LlmChainGenerate:
     def __init__(
@@ -20,13 +21,10 @@ class LlmChainGenerate:
         self.__init_prompt_templates()  # 初始化提示模板
 
     def __init_prompt_templates(self):
-        with open(self.prompt_file, 'r', encoding='utf-8') as f:
-            # 从文件内容创建人类消息模板
-            human_prompt = HumanMessagePromptTemplate.from_template(f.read())
-            # 创建聊天提示模板（包含单一人类消息）
-            self.prompt = ChatPromptTemplate.from_messages([human_prompt])
-            # 绑定额外参数（通过partial方法）
-            self.prompt = self.prompt.partial(**self.params)
+        # 从注册表获取已编译的模板（启动时加载，文件修改后自动重新加载）
+        self.prompt = prompt_registry.get(self.prompt_file)
+        # 绑定额外参数（通过partial方法）
+        self.prompt = self.prompt.partial(**self.params)
 
     def run(self):
         if self.useStrOutputParser:
@@ -43,6 +41,21 @@ class LlmChainGenerate:
             chain = self.prompt | self.llm
             response = chain.invoke({})
 
+        return self._finish(response)
+
+    async def arun(self):
+        """run() 的异步版本，等待模型时不占用线程"""
+        if self.useStrOutputParser:
+            response = ""
+            chain = self.prompt | self.llm | StrOutputParser()
+            async for s in chain.astream({}):
+                response += s
+        else:
+            chain = self.prompt | self.llm
+            response = await chain.ainvoke({})
+        return self._finish(response)
+
+    def _finish(self, response):
         print("\n")  # 换行分隔输出
         # 记录日志（如果存在日志记录器）
         if self.logger is not None:
@@ -0,0 +1,66 @@
+import re
+
+USER_NAME = r"[A-Za-z0-9_\u4e00-\u9fff]{1,32}"
+# 明确的登录/注册命令，已登录的用户发送时也会切换账号
+LOGIN_COMMAND_PATTERN = re.compile(
+    rf"^\s*(?P<action>登录|登陆|注册)\s*(?:账号|用户|用户名)?\s*[:：]?\s*(?P<name>{USER_NAME})\s*[。！!]?\s*$"
+)
+INTRODUCTION_NAME = r"[A-Za-z0-9_\u4e00-\u9fff]{1,16}"
+# 自我介绍式的写法，只在未登录时当作登录；"我是不是吃太多肉了"、"我是否…"和以吗/呢结尾的疑问句不算
+INTRODUCTION_PATTERN = re.compile(
+    rf"^\s*(?:我是|我叫|用户名(?:是|为)?)(?!不是|否|.*[吗呢])\s*[:：]?\s*(?P<name>{INTRODUCTION_NAME})\s*[。！!]?\s*$"
+)
+LOGIN_KEYWORD_PATTERN = re.compile(r"(登录|登陆|注册|我是(?!不是|否)|我叫|用户名)")
+
+LOGIN_REQUIRED_MESSAGE = "请先登录或注册，例如发送“登录张三”或“注册张三”。"
+
+
+class LoginResolver:
+    """
+    在本地解析登录和注册请求
+
+    "登录xxx"、"注册xxx"、"我是xxx" 这类格式明确的输入直接查询或写入 users 表得到 user_id，
+    不需要调用大模型。只有提到了登录但无法解析出用户名时（如"我想登录，名字是小明吧"）
+    resolve() 返回None，由工作流交给大模型判断。
+    """
+
+    def __init__(self, sqLite):
+        self.sqLite = sqLite
+
+    @staticmethod
+    def is_login_command(text):
+        return bool(LOGIN_COMMAND_PATTERN.match(text or ""))
+
+    @staticmethod
+    def mentions_login(text):
+        return bool(LOGIN_KEYWORD_PATTERN.search(text or ""))
+
+    def resolve(self, text):
+        """
+        返回:
+            dict或None: {"user_name": 用户名（登录失败时为空）, "user_id": 用户ID或None, "message": 回复}
+        """
+        text = text or ""
+        match = LOGIN_COMMAND_PATTERN.match(text)
+        if match is not None:
+            action, user_name = match.group("action"), match.group("name")
+        else:
+            match = INTRODUCTION_PATTERN.match(text)
+            if match is None:
+                return None
+            action, user_name = "登录", match.group("name")
+
+        user_id = self.sqLite.login_user(user_name)
+        if action == "注册":
+            if user_id is not None:
+                return {"user_name": user_name, "user_id": user_id,
+                        "message": f"用户 {user_name} 已存在，已为您登录。"}
+            user_id = self.sqLite.register_user(user_name)
+            if user_id is None:
+                # 同时有其他请求注册了同一个用户名
+                user_id = self.sqLite.login_user(user_name)
+            return {"user_name": user_name, "user_id": user_id, "message": f"注册成功，欢迎您，{user_name}！"}
+        if user_id is None:
+            return {"user_name": "", "user_id": None,
+                    "message": f"用户 {user_name} 不存在，请先注册（发送“注册{user_name}”）。"}
+        return {"user_name": user_name, "user_id": user_id, "message": f"登录成功，欢迎回来，{user_name}！"}
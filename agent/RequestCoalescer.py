@@ -0,0 +1,80 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+from db.ResponseCache import ResponseCache
+
+
+class RequestCoalescer:
+    """
+    合并同时进行中的相同请求（single-flight）
+
+    键为 (用户名, 规范化后的请求, 回复风格)。第一个请求正常执行，执行期间到达的相同请求
+    不再重复执行工作流，而是等待第一个请求的结果。结果保存在 concurrent.futures.Future 中，
+    同步（线程）和异步（asyncio）调用方都可以等待。请求结束后立即移除，不做缓存。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.coalesced = 0
+
+    @staticmethod
+    def key(input):
+        # 未登录的请求（登录、注册）不合并，避免不同会话共用同一个登录结果
+        if not input.get("user_name"):
+            return None
+        return input["user_name"], ResponseCache.normalize(input.get("require")), input.get("style") or ""
+
+    def begin(self, key):
+        """
+        返回:
+            tuple: (Future, 是否由当前调用方执行)
+        """
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = Future()
+            self._inflight[key] = future
+            return future, True
+
+    def finish(self, key, future, result=None, error=None):
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def run(self, key, func):
+        """同步执行 func()，相同键的并发调用共享一次执行结果"""
+        if key is None:
+            return func()
+        future, leader = self.begin(key)
+        if not leader:
+            return future.result()
+        try:
+            result = func()
+        except BaseException as e:
+            self.finish(key, future, error=e)
+            raise
+        self.finish(key, future, result)
+        return result
+
+    async def arun(self, key, func):
+        """run() 的异步版本，func 为返回协程的函数"""
+        if key is None:
+            return await func()
+        future, leader = self.begin(key)
+        if not leader:
+            return await asyncio.wrap_future(future)
+        try:
+            result = await func()
+        except BaseException as e:
+            self.finish(key, future, error=e)
+            raise
+        self.finish(key, future, result)
+        return result
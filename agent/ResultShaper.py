@@ -0,0 +1,121 @@
+import json
+from collections import Counter
+
+from utils.PromptRegistry import estimate_tokens
+
+NO_RESULT_MESSAGE = "message: 没有查询到信息."
+# 结果超出上限时按这些列汇总（列名或以 _date 结尾的日期列）
+AGGREGATE_COLUMNS = ("category_name", "meal_type", "food_name")
+OTHER_GROUP = "其他"
+
+
+class ResultShaper:
+    """
+    把SQL结果整理成有上限的紧凑文本，再交给大模型
+
+    结果通过 fetchmany 分批读取，最多保留 max_rows 行明细，同时不超过 max_tokens（估算）；
+    超出的部分不再保存，只在读取过程中按类别、用餐类型、食物和日期计数，
+    最后以"共N行，只显示前M行"加各列的分组计数附在明细后面。无论用户有多少数据，
+    占用的内存和提示词大小都有上限。
+    明细使用表头加"|"分隔的行，比 Python 列表的 repr 节省 token。
+    """
+
+    def __init__(self, max_rows=50, max_tokens=1500, batch_size=200, max_groups=12, max_tracked=1000):
+        self.max_rows = max_rows
+        self.max_tokens = max_tokens
+        self.batch_size = batch_size
+        self.max_groups = max_groups
+        # 每列最多分别计数的不同取值，之后出现的新取值计入"其他"
+        self.max_tracked = max_tracked
+
+    @staticmethod
+    def _format_value(value):
+        if value is None:
+            return ""
+        return str(value).replace("|", "/").replace("\n", " ")
+
+    def _format_row(self, row):
+        return "|".join(self._format_value(value) for value in row)
+
+    @staticmethod
+    def _aggregate_indexes(columns):
+        return [index for index, column in enumerate(columns)
+                if column in AGGREGATE_COLUMNS or column.endswith("_date")]
+
+    def _render_groups(self, column, counter):
+        if column.endswith("_date") and len(counter) > self.max_groups:
+            # 日期太多时按月汇总
+            monthly = Counter()
+            for value, count in counter.items():
+                monthly[str(value)[:7] if value not in (None, OTHER_GROUP) else value] += count
+            counter, column = monthly, f"{column}(按月)"
+        other = counter.pop(OTHER_GROUP, 0)
+        groups = counter.most_common(self.max_groups)
+        other += sum(counter.values()) - sum(count for _, count in groups)
+        text = ", ".join(f"{value or '未知'} {count}" for value, count in groups)
+        if other:
+            text += f", {OTHER_GROUP} {other}"
+        return f"按 {column} 统计: {text}"
+
+    def shape_rows(self, columns, rows):
+        """
+        参数:
+            columns (list): 列名
+            rows (iterable): 结果行，可以是生成器（只遍历一次）
+
+        返回:
+            tuple: (紧凑文本, 总行数)，没有结果时文本为 NO_RESULT_MESSAGE
+        """
+        header = "|".join(columns)
+        lines = [header]
+        tokens = estimate_tokens(header)
+        aggregate_indexes = self._aggregate_indexes(columns)
+        counters = {index: Counter() for index in aggregate_indexes}
+        total = 0
+        truncated = False
+        for row in rows:
+            total += 1
+            for index in aggregate_indexes:
+                counter, value = counters[index], row[index]
+                if value not in counter and len(counter) >= self.max_tracked:
+                    value = OTHER_GROUP
+                counter[value] += 1
+            if truncated:
+                continue
+            line = self._format_row(row)
+            line_tokens = estimate_tokens(line)
+            if len(lines) - 1 >= self.max_rows or tokens + line_tokens > self.max_tokens:
+                truncated = True
+                continue
+            lines.append(line)
+            tokens += line_tokens
+
+        if total == 0:
+            return NO_RESULT_MESSAGE, 0
+        if truncated:
+            lines.append(f"(共 {total} 行，只显示前 {len(lines) - 1} 行，以下为全部结果的汇总)")
+            lines.extend(self._render_groups(columns[index], counters[index]) for index in aggregate_indexes)
+        return "\n".join(lines), total
+
+    def _iter_cursor(self, cursor):
+        while True:
+            batch = cursor.fetchmany(self.batch_size)
+            if not batch:
+                return
+            yield from batch
+
+    def shape_cursor(self, cursor):
+        """分批读取游标中的结果，返回值同 shape_rows"""
+        columns = [description[0] for description in cursor.description or ()]
+        return self.shape_rows(columns, self._iter_cursor(cursor))
+
+
+def format_sql_and_result(sql_and_result):
+    """把 [{SQL语句: 结果}] 渲染成提示词中的文本"""
+    parts = []
+    for item in sql_and_result or []:
+        for statement, result in item.items():
+            if not isinstance(result, str):
+                result = json.dumps(result, ensure_ascii=False, default=str)
+            parts.append(f"SQL：{statement}\n结果：\n{result}")
+    return "\n\n".join(parts)
@@ -0,0 +1,282 @@
+import re
+import time
+from datetime import datetime, timedelta
+
+from agent.IntentRouter import INTENT_RECORD, INTENT_QUERY, INTENT_ADVICE, NOT_EATEN_PATTERN
+from agent.ResultShaper import ResultShaper
+from utils.Tracer import tracer
+
+MEAL_TYPE_KEYWORDS = [
+    ("breakfast", ("早餐", "早饭", "早点", "早上")),
+    ("lunch", ("午餐", "午饭", "中饭", "中午")),
+    ("dinner", ("晚餐", "晚饭", "晚上")),
+    ("snack", ("加餐", "下午茶", "零食", "夜宵", "宵夜")),
+]
+
+RECORD_PATTERN = re.compile(r"(?:吃了|喝了|吃的是|吃的)(?P<food>[^，,。！!？?；;]+)")
+# 一条消息中的多餐记录按标点分段，每段可以带自己的用餐类型
+SEGMENT_SEPARATOR = re.compile(r"[，,。！!；;\n]+")
+MEAL_KEYWORD_PATTERN = re.compile(
+    "|".join(keyword for _, keywords in MEAL_TYPE_KEYWORDS for keyword in sorted(keywords, key=len, reverse=True))
+)
+FOOD_PREFIX_PATTERN = re.compile(r"^(?:(?:还|又|也|我|今天|昨天|前天|今日|昨日)|(?:吃了|喝了|吃的是|吃的|吃|喝|是|有|[:：]))+")
+# 没有"吃了"等过去时动词的分段只接受"早餐燕麦粥"这种直接列出食物的写法，"早餐吃包子"可能还没吃
+EAT_VERB_PATTERN = re.compile(r"[吃喝]")
+# 食物名前面的数量词，如"一碗"、"两个"、"3块"；"三明治"这类没有量词的不算
+QUANTITY_PATTERN = re.compile(
+    r"(^|和|与|跟|加)(?:\d+|[一二两三四五六七八九十半几]+)(?:小|大)?"
+    r"(?:个|碗|份|杯|盘|块|片|根|串|只|条|瓶|盒|袋|勺|颗|粒|张|罐|碟|些)"
+)
+# 去掉数量词后仍然包含时间、地点等内容的不是单纯的食物名，如"八点吃了包子"、"在食堂吃了米饭"
+NOT_FOOD_PATTERN = re.compile(r"(\d|[零一二两三四五六七八九十]点|点钟|点半|在|去|到|从|家里|食堂|公司|学校|餐厅|外卖)")
+ISO_DATE_PATTERN = re.compile(r"(\d{4})[-/年](\d{1,2})[-/月](\d{1,2})")
+MONTH_DAY_PATTERN = re.compile(r"(\d{1,2})月(\d{1,2})[日号]")
+# 报告、统计类查询只需要各类别的汇总次数
+SUMMARY_PATTERN = re.compile(r"(报告|统计|总结|汇总|分析|均衡|几次|多少次)")
+# 建议类请求没有指定时间范围时参考最近一周的饮食
+DEFAULT_SUMMARY_DAYS = 7
+RELATIVE_DAYS = [("大前天", 3), ("前天", 2), ("昨天", 1), ("昨日", 1), ("今天", 0), ("今日", 0)]
+
+INSERT_MEAL_SQL = "INSERT INTO meals (user_id, meal_date, meal_type, food_name, category_id) VALUES {values}"
+SELECT_MEALS_SQL = ("SELECT m.meal_date, m.meal_type, m.food_name, c.category_name FROM meals m "
+                    "LEFT JOIN food_categories c ON m.category_id = c.category_id "
+                    "WHERE m.user_id = ? AND m.meal_date >= ? AND m.meal_date <= ?")
+# 与 SQLiteDB.get_category_summary 等价的语句，展示给 conclude 说明结果各列的含义
+SUMMARY_SQL = ("SELECT c.category_name, SUM(d.meal_count), c.recommended_frequency FROM food_categories c "
+               "LEFT JOIN meal_category_daily d ON d.category_id = c.category_id "
+               "AND d.user_id = ? AND d.meal_date >= ? AND d.meal_date <= ? GROUP BY c.category_id")
+
+
+def extract_meal_type(text):
+    for meal_type, keywords in MEAL_TYPE_KEYWORDS:
+        if any(keyword in text for keyword in keywords):
+            return meal_type
+    return None
+
+
+def infer_meal_type(now):
+    # 与 sql_generate.txt 中根据当前时间推断用餐类型的规则一致
+    if 6 <= now.hour < 10:
+        return "breakfast"
+    if 10 <= now.hour < 14:
+        return "lunch"
+    if 17 <= now.hour < 21:
+        return "dinner"
+    return "snack"
+
+
+def has_explicit_date(text):
+    return bool(ISO_DATE_PATTERN.search(text) or MONTH_DAY_PATTERN.search(text))
+
+
+def extract_date(text, now):
+    # "2月30日" 这类不存在的日期返回None，由大模型处理
+    try:
+        match = ISO_DATE_PATTERN.search(text)
+        if match:
+            return datetime(*map(int, match.groups())).date()
+        match = MONTH_DAY_PATTERN.search(text)
+        if match:
+            return datetime(now.year, int(match.group(1)), int(match.group(2))).date()
+    except ValueError:
+        return None
+    for keyword, days in RELATIVE_DAYS:
+        if keyword in text:
+            return (now - timedelta(days=days)).date()
+    return None
+
+
+def extract_date_range(text, now):
+    today = now.date()
+    monday = today - timedelta(days=today.weekday())
+    if "上周" in text or "上个星期" in text or "上星期" in text:
+        return monday - timedelta(days=7), monday - timedelta(days=1)
+    if "这周" in text or "本周" in text or "这个星期" in text or "这星期" in text:
+        return monday, today
+    if "最近一周" in text or "最近7天" in text or "最近七天" in text:
+        return today - timedelta(days=6), today
+    if "上个月" in text or "上月" in text:
+        last_day = today.replace(day=1) - timedelta(days=1)
+        return last_day.replace(day=1), last_day
+    if "这个月" in text or "本月" in text:
+        return today.replace(day=1), today
+    day = extract_date(text, now)
+    if day is not None:
+        return day, day
+    return None
+
+
+class SqlTemplates:
+    """
+    高频意图的确定性SQL模板
+
+    对"今天X餐吃了Y"和"这周我吃了什么"这类请求，在本地提取槽位（日期、用餐类型、
+    食物名称，类别由 SQLiteDB.resolve_food_category 在本地解析）后直接通过 SQLiteDB.record_meals / iter_user_meals 执行参数化语句，
+    建议和报告类请求通过 SQLiteDB.get_category_summary 读取按类别汇总的次数，
+    完全跳过大模型生成SQL。槽位提取失败时 match() 返回None，由工作流回到原来的路径。
+    """
+
+    def __init__(self, sqLite, result_shaper=None):
+        self.sqLite = sqLite
+        self.result_shaper = result_shaper if result_shaper is not None else ResultShaper()
+
+    def match(self, text, intent, now=None):
+        """
+        根据意图和用户输入提取槽位
+
+        返回:
+            dict或None: {"template": "record"/"query"/"summary", "slots": {...}}
+        """
+        now = now or datetime.now()
+        text = text or ""
+        if intent == INTENT_RECORD:
+            return self._match_record(text, now)
+        if intent == INTENT_QUERY:
+            if SUMMARY_PATTERN.search(text):
+                return self._match_summary(text, now)
+            return self._match_query(text, now)
+        if intent == INTENT_ADVICE:
+            return self._match_summary(text, now)
+        return None
+
+    def _parse_items(self, text, now):
+        """
+        把一条消息拆成多条用餐记录，如"早餐燕麦粥，午餐西红柿炒鸡蛋，晚餐鱼"
+
+        没有写用餐类型的分段沿用前一段的类型（"中午吃了米饭，还喝了汤"），
+        第一段也没有时根据当前时间推断。
+        只接受带"吃了/喝了/吃的是"或"X餐+食物"形式的分段，任何一段是否定或计划中的用餐
+        （"没吃"、"不想吃"、"打算吃"、"明天早餐吃"）或无法确定已经吃过时返回空列表，整条消息交给大模型。
+        有动词时食物名取动词后面的部分并去掉数量词（"早上8点吃了两个包子" -> "包子"），
+        剩下的仍不是单纯的食物名（带时间、地点）时同样返回空列表。
+        """
+        items = []
+        meal_type = None
+        for segment in SEGMENT_SEPARATOR.split(text):
+            segment = segment.strip()
+            if not segment:
+                continue
+            if NOT_EATEN_PATTERN.search(segment):
+                return []
+            keyword = MEAL_KEYWORD_PATTERN.search(segment)
+            match = RECORD_PATTERN.search(segment)
+            if keyword:
+                meal_type = extract_meal_type(keyword.group())
+            if match:
+                # "吃了早餐" 中的用餐类型不是食物
+                food_name = segment[max(match.start("food"), keyword.end() if keyword else 0):]
+            elif keyword:
+                food_name = segment[keyword.end():]
+            elif items:
+                food_name = segment
+            else:
+                continue
+            if not match and EAT_VERB_PATTERN.search(food_name):
+                return []
+            food_name = FOOD_PREFIX_PATTERN.sub("", food_name.strip()).strip()
+            food_name = QUANTITY_PATTERN.sub(r"\1", food_name).strip()
+            if not food_name:
+                continue
+            if NOT_FOOD_PATTERN.search(food_name) or EAT_VERB_PATTERN.search(food_name):
+                return []
+            items.append({
+                "meal_type": meal_type or infer_meal_type(now),
+                "food_name": food_name,
+                "category_id": self.sqLite.resolve_food_category(food_name),
+            })
+        return items
+
+    def _match_record(self, text, now):
+        items = self._parse_items(text, now)
+        # 任何一项无法确定类别时整条消息交给大模型处理，避免只记录了一部分
+        if not items or any(item["category_id"] is None for item in items):
+            return None
+        meal_date = extract_date(text, now)
+        if meal_date is None:
+            if has_explicit_date(text):
+                # 写了日期但日期无效
+                return None
+            meal_date = now.date()
+        return {
+            "template": "record",
+            "slots": {
+                "meal_date": meal_date.isoformat(),
+                "items": items,
+            }
+        }
+
+    def _match_query(self, text, now):
+        date_range = extract_date_range(text, now)
+        if date_range is None:
+            return None
+        start_date, end_date = date_range
+        return {
+            "template": "query",
+            "slots": {
+                "start_date": start_date.isoformat(),
+                "end_date": end_date.isoformat(),
+            }
+        }
+
+    def _match_summary(self, text, now):
+        date_range = extract_date_range(text, now)
+        if date_range is None:
+            if has_explicit_date(text):
+                return None
+            today = now.date()
+            date_range = today - timedelta(days=DEFAULT_SUMMARY_DAYS - 1), today
+        start_date, end_date = date_range
+        return {
+            "template": "summary",
+            "slots": {
+                "start_date": start_date.isoformat(),
+                "end_date": end_date.isoformat(),
+            }
+        }
+
+    def execute(self, plan, user_id):
+        """
+        执行模板并返回与 conclude 节点相同格式的 sql_and_result 列表
+        """
+        start = time.perf_counter()
+        statement, result, rows = self._execute(plan, user_id)
+        tracer.record_sql(statement, time.perf_counter() - start, rows, source="template")
+        return [{statement: result}]
+
+    def _execute(self, plan, user_id):
+        """返回 (语句, 结果, 行数)"""
+        slots = plan["slots"]
+        if plan["template"] == "record":
+            meals = [
+                (user_id, item["meal_type"], item["food_name"], item["category_id"], None, slots["meal_date"])
+                for item in slots["items"]
+            ]
+            category_names = {category_id: name for name, category_id in self.sqLite.get_category_ids().items()}
+            # 所有条目在一个事务中用一条多行INSERT写入
+            meal_ids = self.sqLite.record_meals(meals, category_guessed=True)
+            statement = INSERT_MEAL_SQL.format(values=", ".join(["(?, ?, ?, ?, ?)"] * len(meals)))
+            result = {
+                "message": f"INSERT 成功，受影响行数: {len(meal_ids)}",
+                "items": [
+                    {"meal_id": meal_id, "meal_date": slots["meal_date"], "meal_type": item["meal_type"],
+                     "food_name": item["food_name"], "category_name": category_names.get(item["category_id"])}
+                    for meal_id, item in zip(meal_ids, slots["items"])
+                ]
+            }
+            return statement, result, len(meal_ids)
+
+        params = (user_id, slots["start_date"], slots["end_date"])
+        if plan["template"] == "summary":
+            summary = self.sqLite.get_category_summary(user_id, slots["start_date"], slots["end_date"])
+            rows = [[s["category_name"] or "未分类", s["meal_count"], s["recommended_frequency"]] for s in summary]
+            if not any(s["meal_count"] for s in summary):
+                return f"{SUMMARY_SQL} {params}", "message: 没有查询到信息.", 0
+            return f"{SUMMARY_SQL} {params}", rows, len(rows)
+
+        # 分页读取，结果超出上限时只保留前面的明细和分组汇总
+        meals = self.sqLite.iter_user_meals(user_id, slots["start_date"], slots["end_date"])
+        result, rows = self.result_shaper.shape_rows(
+            ["meal_date", "meal_type", "food_name", "category_name"],
+            ((m.meal_date, m.meal_type, m.food_name, m.category_name) for m in meals)
+        )
+        return f"{SELECT_MEALS_SQL} {params}", result, rows
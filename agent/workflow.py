@@ -1,17 +1,36 @@
+import asyncio
+import json
+import re
+import time
 from datetime import datetime
 
 from langchain_community.agent_toolkits import SQLDatabaseToolkit
 from langchain_core.messages import AIMessage, ToolMessage
 from langchain_core.runnables import RunnableWithFallbacks, RunnableLambda
 from langgraph.graph import END, StateGraph, START
-from langgraph.prebuilt import ToolNode
+from langgraph.prebuilt import ToolNode, InjectedState
 from langchain_core.tools import tool
 
 from pydantic import BaseModel, Field
 from sqlalchemy.exc import SQLAlchemyError
 
-from utils.LLMUtil import get_llm_chain, AgentState, get_prompt_file, get_new_llm
-from typing import Annotated, Literal, Any, Dict, Union, Sequence
+from agent.IntentRouter import IntentRouter, INTENT_QUERY, INTENT_ADVICE
+from agent.LoginResolver import LoginResolver, LOGIN_REQUIRED_MESSAGE
+from agent.RequestCoalescer import RequestCoalescer
+from agent.ResultShaper import ResultShaper, format_sql_and_result
+from agent.SqlTemplates import SqlTemplates
+from db.QueryGuard import QueryRejected
+from utils.PromptRegistry import prompt_registry
+from utils.Tracer import tracer, current_request_id
+from utils.LLMUtil import get_llm_chain, aget_llm_chain, AgentState, get_prompt_file, get_llm, model_registry
+from typing import Annotated, Literal, Any, Dict, Union, Sequence, Optional
+
+
+NO_RESPONSE_MESSAGE = "没有获取到响应消息"
+# 返回给大模型的SQL错误以此开头，execute_query 之后据此回到 query_gen 重新生成
+QUERY_ERROR_PREFIX = "错误："
+# 生成的SQL被拒绝后最多重新生成的次数
+MAX_QUERY_RETRIES = 2
 
 
 class SubmitFinalAnswer(BaseModel):
@@ -19,91 +38,425 @@ class SubmitFinalAnswer(BaseModel):
     final_answer: Dict[str, Any] = Field(..., description="The final answer to the user")
 
 
+class AnswerStreamExtractor:
+    """
+    从 conclude 节点的流式输出中提取最终回答的增量文本
+
+    conclude 通过 SubmitFinalAnswer 工具返回答案时，答案位于逐块到达的工具参数JSON中
+    （{"final_answer": {"message": "..."}}），这里在JSON尚不完整时就解析出 message 字段
+    已经到达的部分；模型直接返回文本时则原样输出 content。
+    """
+
+    MESSAGE_START = re.compile(r'"message"\s*:\s*"')
+
+    def __init__(self):
+        self.args = ""
+        self.content = ""
+        self.emitted = 0
+
+    def _partial_message(self):
+        match = self.MESSAGE_START.search(self.args)
+        if not match:
+            return ""
+        raw = self.args[match.end():]
+        end = 0
+        i = 0
+        while i < len(raw):
+            if raw[i] == "\\":
+                # 转义序列不完整时等待下一块
+                length = 6 if raw[i + 1:i + 2] == "u" else 2
+                if i + length > len(raw):
+                    break
+                # 代理对的高位（\ud800-\udbff）要等低位的 \uXXXX 一起到达后再解码
+                if length == 6 and "d800" <= raw[i + 2:i + 6].lower() <= "dbff":
+                    length = 12
+                    if i + length > len(raw):
+                        break
+                i += length
+            elif raw[i] == '"':
+                break
+            else:
+                i += 1
+            end = i
+        return json.loads(f'"{raw[:end]}"')
+
+    def feed(self, chunk):
+        """
+        处理一个消息块
+
+        返回:
+            str: 新到达的回答文本（可能为空字符串）
+        """
+        tool_call_chunks = getattr(chunk, "tool_call_chunks", None) or []
+        for tool_call_chunk in tool_call_chunks:
+            self.args += tool_call_chunk.get("args") or ""
+        if isinstance(chunk.content, str):
+            self.content += chunk.content
+        message = self._partial_message() if self.args else self.content
+        delta = message[self.emitted:]
+        self.emitted = len(message)
+        return delta
+
+
 class WorkFlow:
     sqLite = None
-
-    def __init__(self, sqLite, logger=None):
+    # 查询结果交给大模型前的行数和大小上限（agent.ResultShaper）
+    result_shaper = ResultShaper()
+
+    # 各提示词模板需要的变量，与下面各节点调用 get_llm_chain 时传入的参数一致
+    PROMPT_VARIABLES = {
+        "judge_username.txt": {"require"},
+        "judge_query.txt": {"require"},
+        "sql_generate.txt": {"require", "list_tables_tool_result", "get_schema_tool_result", "user_name",
+                             "user_id", "current_time", "history", "tool_feedback"},
+        "conclude.txt": {"require", "sql_and_result", "history"},
+    }
+
+    def __init__(self, sqLite, logger=None, use_schema_cache=True, intent_router=None, response_cache=None,
+                 max_concurrency=16, callbacks=None, memory=None, result_shaper=None):
         self.logger = logger
+        # 每次执行工作流时传入的 LangChain 回调（如基准测试统计各节点耗时）
+        self.callbacks = callbacks
+        # arun 同时执行的请求数上限
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        # 为True时直接使用表结构快照，跳过 list_tables -> model_get_schema -> get_schema 的发现流程
+        self.use_schema_cache = use_schema_cache
+        # 本地意图路由，置信度不足时才回退到大模型判断
+        self.intent_router = intent_router if intent_router is not None else IntentRouter()
+        if result_shaper is not None:
+            WorkFlow.result_shaper = result_shaper
+        self.sql_templates = SqlTemplates(sqLite, WorkFlow.result_shaper)
+        # 本地解析登录/注册，只有无法解析的输入才调用大模型
+        self.login_resolver = LoginResolver(sqLite)
+        # 合并同时进行中的相同请求
+        self.coalescer = RequestCoalescer()
+        # conclude 回答缓存（db.ResponseCache），为None时不缓存
+        self.response_cache = response_cache
+        # 服务端对话记忆（agent.ConversationMemory），为None时每个请求独立处理
+        self.memory = memory
         WorkFlow.sqLite = sqLite
-        toolkit = SQLDatabaseToolkit(db=sqLite.get_sqlDatabase(), llm=get_new_llm())
+        prompt_registry.validate(self.PROMPT_VARIABLES)
+        toolkit = SQLDatabaseToolkit(db=sqLite.get_sqlDatabase(), llm=get_llm())
         tools = toolkit.get_tools()
 
         self.list_tables_tool = next(tool for tool in tools if tool.name == "sql_db_list_tables")
         self.get_schema_tool = next(tool for tool in tools if tool.name == "sql_db_schema")
 
+        # 各节点使用的模型在这里绑定一次，之后所有请求共享
+        self.login_llm = model_registry.bind_tools(
+            "login", [self.list_tables_tool, SubmitFinalAnswer], tool_choice="required")
+        self.query_llm = model_registry.bind_tools("db_query", [self.db_query_tool], tool_choice="required")
+        self.conclude_llm = model_registry.bind_tools("conclude", [SubmitFinalAnswer])
+        self.model_get_schema = model_registry.bind_tools("get_schema", [self.get_schema_tool])
+
         self.workflow = StateGraph(AgentState)
 
         # 添加节点和边
-        self.workflow.add_node("login", self.login)
-        self.workflow.add_node("judge_query", self.judge_query)
+        # 调用模型的节点同时提供同步和异步实现，分别用于 invoke 和 ainvoke
+        self.workflow.add_node("login", RunnableLambda(self.login, afunc=self.alogin))
+        self.workflow.add_node("judge_query", RunnableLambda(self.judge_query, afunc=self.ajudge_query))
         self.workflow.add_node("first_tool_call", self.first_tool_call)
         self.workflow.add_node("list_tables_tool", self.create_tool_node_with_fallback([self.list_tables_tool]))
-        self.model_get_schema = get_new_llm().bind_tools([self.get_schema_tool])
-        self.workflow.add_node("model_get_schema", lambda state: {"messages": [self.model_get_schema.invoke(state["messages"])]})
+        self.workflow.add_node("model_get_schema", RunnableLambda(self.get_schema, afunc=self.aget_schema))
         self.workflow.add_node("get_schema_tool", self.create_tool_node_with_fallback([self.get_schema_tool]))
-        self.workflow.add_node("query_gen", self.query_gen_node)
-        self.workflow.add_node("correct_query", self.model_check_query)
+        self.workflow.add_node("template_query", self.template_query)
+        self.workflow.add_node("query_gen", RunnableLambda(self.query_gen_node, afunc=self.aquery_gen_node))
+        self.workflow.add_node("validate_query", self.validate_query)
         self.workflow.add_node("execute_query", self.create_tool_node_with_fallback([self.db_query_tool]))
-        self.workflow.add_node("conclude", self.conclude)
+        self.workflow.add_node("conclude", RunnableLambda(self.conclude, afunc=self.aconclude))
 
         # 添加条件边和普通边
         self.workflow.add_conditional_edges(START, self.judge_login_route)
         self.workflow.add_conditional_edges("login", self.should_continue_login)
         self.workflow.add_conditional_edges("judge_query", self.route)
+        self.workflow.add_conditional_edges("template_query", self.should_continue_template)
         self.workflow.add_edge("first_tool_call", "list_tables_tool")
         self.workflow.add_edge("list_tables_tool", "model_get_schema")
         self.workflow.add_edge("model_get_schema", "get_schema_tool")
         self.workflow.add_edge("get_schema_tool", "query_gen")
-        self.workflow.add_edge("query_gen", "execute_query")
-        self.workflow.add_edge("execute_query", "conclude")
+        self.workflow.add_edge("query_gen", "validate_query")
+        self.workflow.add_conditional_edges("validate_query", self.should_execute_query)
+        self.workflow.add_conditional_edges("execute_query", self.should_retry_query)
         self.workflow.add_edge("conclude", END)
 
         self.app = self.workflow.compile()
 
     def run(self, input):
+        # 同一用户同时发出的相同请求（如重复点击发送）只执行一次
+        return self.coalescer.run(self.coalescer.key(input),
+                                  lambda: self._remember(input, self._run(self._prepare_input(input))))
+
+    def _run(self, input):
+        cache_key, user_id = self._response_cache_key(input)
+        if cache_key is not None:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                return input.get("user_name", ""), cached
+
         try:
-            result = self.app.invoke(input, {"recursion_limit": 100})
-            user_name = result.get("user_name", "")
-            messages = result.get("messages", [])
+            result = self.app.invoke(input, self._run_config(self._begin_request()))
+            return self._handle_result(result, cache_key, user_id)
+        except Exception as e:
+            print(f"处理响应时出错: {str(e)}")
+            return "", f"处理响应时出错: {str(e)}"
 
-            if not messages:
-                return user_name, "没有获取到响应消息"
+    async def arun(self, input):
+        """run() 的异步版本，使用 ainvoke 执行工作流，同时执行的请求数受 max_concurrency 限制"""
+        async def run_and_remember():
+            return self._remember(input, await self._arun(self._prepare_input(input)))
 
-            last_message = messages[-1]
+        return await self.coalescer.arun(self.coalescer.key(input), run_and_remember)
 
-            if hasattr(last_message, "tool_calls") and last_message.tool_calls:
-                tool_call = last_message.tool_calls[0]
-                args = tool_call.get("args", {})
-                final_answer = args.get("final_answer", {})
-                message = final_answer.get("message", "没有获取到有效回答")
-            else:
-                message = getattr(last_message, "content", "没有获取到有效回答")
+    async def _arun(self, input):
+        cache_key, user_id = self._response_cache_key(input)
+        if cache_key is not None:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                return input.get("user_name", ""), cached
 
-            return user_name, message
+        try:
+            async with self.semaphore:
+                result = await self.app.ainvoke(input, self._run_config(self._begin_request()))
+            return self._handle_result(result, cache_key, user_id)
         except Exception as e:
             print(f"处理响应时出错: {str(e)}")
             return "", f"处理响应时出错: {str(e)}"
 
+    def stream(self, input):
+        """
+        流式执行工作流
+
+        依次返回 {"type": "token", "text": 增量文本}（来自 conclude 节点的输出），
+        最后返回 {"type": "final", "user_name": ..., "message": ...}。
+        与进行中的请求相同时不再执行，等待其结束后只返回 final。
+        """
+        key = self.coalescer.key(input)
+        if key is not None:
+            future, leader = self.coalescer.begin(key)
+            if not leader:
+                user_name, message = future.result()
+                yield {"type": "final", "user_name": user_name, "message": message}
+                return
+        outcome = ("", NO_RESPONSE_MESSAGE)
+        try:
+            for event in self._stream(self._prepare_input(input)):
+                if event["type"] == "final":
+                    outcome = self._remember(input, (event["user_name"], event["message"]))
+                yield event
+        finally:
+            if key is not None:
+                self.coalescer.finish(key, future, outcome)
+
+    def _stream(self, input):
+        cache_key, user_id = self._response_cache_key(input)
+        if cache_key is not None:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                yield {"type": "final", "user_name": input.get("user_name", ""), "message": cached}
+                return
+
+        extractor = AnswerStreamExtractor()
+        result = None
+        try:
+            for mode, payload in self.app.stream(input, self._run_config(self._begin_request()), stream_mode=["messages", "values"]):
+                if mode == "values":
+                    result = payload
+                    continue
+                text = self._stream_token(extractor, payload)
+                if text:
+                    yield {"type": "token", "text": text}
+            user_name, message = self._handle_result(result or {}, cache_key, user_id)
+        except Exception as e:
+            print(f"处理响应时出错: {str(e)}")
+            user_name, message = "", f"处理响应时出错: {str(e)}"
+        yield {"type": "final", "user_name": user_name, "message": message}
+
+    async def astream(self, input):
+        """stream() 的异步版本，同时执行的请求数受 max_concurrency 限制"""
+        key = self.coalescer.key(input)
+        if key is not None:
+            future, leader = self.coalescer.begin(key)
+            if not leader:
+                user_name, message = await asyncio.wrap_future(future)
+                yield {"type": "final", "user_name": user_name, "message": message}
+                return
+        outcome = ("", NO_RESPONSE_MESSAGE)
+        try:
+            async for event in self._astream(self._prepare_input(input)):
+                if event["type"] == "final":
+                    outcome = self._remember(input, (event["user_name"], event["message"]))
+                yield event
+        finally:
+            if key is not None:
+                self.coalescer.finish(key, future, outcome)
+
+    async def _astream(self, input):
+        cache_key, user_id = self._response_cache_key(input)
+        if cache_key is not None:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                yield {"type": "final", "user_name": input.get("user_name", ""), "message": cached}
+                return
+
+        extractor = AnswerStreamExtractor()
+        result = None
+        try:
+            async with self.semaphore:
+                async for mode, payload in self.app.astream(input, self._run_config(self._begin_request()),
+                                                            stream_mode=["messages", "values"]):
+                    if mode == "values":
+                        result = payload
+                        continue
+                    text = self._stream_token(extractor, payload)
+                    if text:
+                        yield {"type": "token", "text": text}
+            user_name, message = self._handle_result(result or {}, cache_key, user_id)
+        except Exception as e:
+            print(f"处理响应时出错: {str(e)}")
+            user_name, message = "", f"处理响应时出错: {str(e)}"
+        yield {"type": "final", "user_name": user_name, "message": message}
+
+    def _prepare_input(self, input):
+        """
+        补充输入中没有的 user_id 和该用户之前的对话上下文（客户端不需要重复发送历史记录）
+
+        之后的节点直接使用 user_id，不再通过用户名查询
+        """
+        input = dict(input)
+        if "user_id" not in input:
+            user_name = input.get("user_name")
+            input["user_id"] = WorkFlow.sqLite.login_user(user_name) if user_name else None
+        if self.memory is not None and "history" not in input:
+            input["history"] = self.memory.context(input.get("user_name"))
+        return input
+
+    def _remember(self, input, result):
+        user_name, message = result
+        if self.memory is not None and message != NO_RESPONSE_MESSAGE and not message.startswith("处理响应时出错"):
+            # 登录请求记到登录后的用户名下
+            self.memory.add_turn(user_name or input.get("user_name"), input.get("require"), message)
+        return result
+
+    @staticmethod
+    def _begin_request():
+        # 每个请求一个ID，节点内部（如执行SQL时）通过 current_request_id 读取
+        request_id = tracer.new_request_id()
+        current_request_id.set(request_id)
+        return request_id
+
+    def _run_config(self, request_id):
+        config = {"recursion_limit": 100, "metadata": {"request_id": request_id}}
+        callbacks = list(self.callbacks or [])
+        # 请求追踪（utils.Tracer）未启用时不挂载回调
+        if tracer.enabled:
+            callbacks.append(tracer)
+        if callbacks:
+            config["callbacks"] = callbacks
+        return config
+
+    @staticmethod
+    def _stream_token(extractor, payload):
+        chunk, metadata = payload
+        # 只把 conclude 节点的输出流式返回给用户
+        if metadata.get("langgraph_node") != "conclude":
+            return ""
+        return extractor.feed(chunk)
+
+    def _handle_result(self, result, cache_key, user_id):
+        user_name = result.get("user_name", "")
+        messages = result.get("messages", [])
+
+        if not messages:
+            return user_name, NO_RESPONSE_MESSAGE
+
+        last_message = messages[-1]
+
+        if hasattr(last_message, "tool_calls") and last_message.tool_calls:
+            tool_call = last_message.tool_calls[0]
+            args = tool_call.get("args", {})
+            final_answer = args.get("final_answer", {})
+            message = final_answer.get("message")
+        else:
+            message = getattr(last_message, "content", None)
+
+        if not message:
+            return user_name, "没有获取到有效回答"
+        if cache_key is not None:
+            self.response_cache.put(cache_key, user_id, message)
+        return user_name, message
+
+    def _response_cache_key(self, input):
+        """只缓存查询和建议类请求，记录、登录等会改变数据的请求总是完整执行"""
+        user_id = input.get("user_id")
+        if self.response_cache is None or user_id is None:
+            return None, None
+        intent, _, _ = self.intent_router.classify(input.get("require"))
+        if intent not in (INTENT_QUERY, INTENT_ADVICE):
+            return None, None
+        data_version = WorkFlow.sqLite.get_data_version(user_id)
+        # conclude 的回答依赖注入的对话历史，历史不同时不能共用缓存
+        key = self.response_cache.make_key(input.get("require"), user_id, input.get("style"), data_version,
+                                           history=input.get("history"))
+        return key, user_id
+
     def route(self, state):
         judge_result = state.get("judge_result", "")
+        if state.get("sql_plan"):
+            return "template_query"
         if judge_result == "only_db":
-            return "first_tool_call"
+            return "query_gen" if self.use_schema_cache else "first_tool_call"
         elif judge_result == "db_rag":
             return "rag_retrieval"
         else:
             return "judge_query"  # 默认路由
 
-    def login(self, state):
-        prompt_file = get_prompt_file("judge_username.txt")
-        message = get_llm_chain(
-            llm=get_new_llm().bind_tools([self.list_tables_tool, SubmitFinalAnswer], tool_choice="required"),
-            prompt_file=prompt_file,
+    def _login_chain(self, state):
+        return dict(
+            llm=self.login_llm,
+            prompt_file=get_prompt_file("judge_username.txt"),
             require=state["require"],
             logger=self.logger
         )
+
+    def _login_locally(self, state):
+        """
+        在本地处理登录，格式明确的登录/注册直接得到 user_id，未登录时发来的其他请求直接提示先登录，
+        只有提到登录但无法解析用户名时返回None，交给大模型判断
+        """
+        require = state.get("require")
+        resolved = self.login_resolver.resolve(require)
+        if resolved is None:
+            if self.login_resolver.mentions_login(require):
+                return None
+            resolved = {"user_name": state.get("user_name", ""), "user_id": state.get("user_id"),
+                        "message": LOGIN_REQUIRED_MESSAGE}
+        elif resolved["user_id"] is None:
+            # 登录失败时保持原来的登录状态
+            resolved = dict(resolved, user_name=state.get("user_name", ""), user_id=state.get("user_id"))
+        final_answer = {"user_name": resolved["user_name"], "message": resolved["message"]}
+        return {
+            "user_name": resolved["user_name"],
+            "user_id": resolved["user_id"],
+            "messages": [AIMessage(content="", tool_calls=[{
+                "name": "SubmitFinalAnswer", "args": {"final_answer": final_answer}, "id": "login_local",
+            }])]
+        }
+
+    def login(self, state):
+        result = self._login_locally(state)
+        if result is not None:
+            return result
+        message = get_llm_chain(**self._login_chain(state))
+        return {"messages": [message]}
+
+    async def alogin(self, state):
+        result = self._login_locally(state)
+        if result is not None:
+            return result
+        message = await aget_llm_chain(**self._login_chain(state))
         return {"messages": [message]}
 
-    def should_continue_login(self, state: AgentState) -> Literal[END, "list_tables_tool"]:
+    def should_continue_login(self, state: AgentState) -> Literal[END, "list_tables_tool", "query_gen"]:
         messages = state.get("messages", [])
         if not messages:
             return END
@@ -112,15 +465,17 @@ class WorkFlow:
         tool_calls = last_message.tool_calls if hasattr(last_message, "tool_calls") else []
 
         if tool_calls and tool_calls[0].get("name") == "sql_db_list_tables":
-            return "list_tables_tool"
+            return "query_gen" if self.use_schema_cache else "list_tables_tool"
         elif tool_calls and tool_calls[0].get("name") == "SubmitFinalAnswer":
             return END
         else:
             return END
 
     def judge_login_route(self, state):
-        user_name = state.get("user_name", "")
-        return "login" if user_name == "" else "judge_query"
+        # 未登录（没有 user_id）或发送了明确的登录/注册命令时进入登录节点
+        if state.get("user_id") is None or self.login_resolver.is_login_command(state.get("require")):
+            return "login"
+        return "judge_query"
 
     def create_tool_node_with_fallback(self, tools: list) -> RunnableWithFallbacks[Any, dict]:
         return ToolNode(tools).with_fallbacks(
@@ -140,18 +495,11 @@ class WorkFlow:
             ]
         }
 
-    def should_continue(self, state: AgentState) -> Literal[END, "correct_query", "query_gen"]:
-        messages = state.get("messages", [])
-        if not messages:
-            return END
+    def get_schema(self, state):
+        return {"messages": [self.model_get_schema.invoke(state["messages"])]}
 
-        last_message = messages[-1]
-        if hasattr(last_message, "tool_calls") and last_message.tool_calls:
-            return END
-        if last_message.content.startswith("错误"):
-            return "query_gen"
-        else:
-            return "correct_query"
+    async def aget_schema(self, state):
+        return {"messages": [await self.model_get_schema.ainvoke(state["messages"])]}
 
     def first_tool_call(self, state: AgentState) -> dict[str, list[AIMessage]]:
         return {
@@ -167,7 +515,7 @@ class WorkFlow:
             ]
         }
 
-    def query_gen_node(self, state: AgentState):
+    def _query_gen_chain(self, state: AgentState):
         state.setdefault("list_tables_tool_result", None)
         state.setdefault("get_schema_tool_result", None)
 
@@ -179,28 +527,45 @@ class WorkFlow:
                 elif message.name == "sql_db_schema":
                     state["get_schema_tool_result"] = message.content
 
-        prompt_file = get_prompt_file("sql_generate.txt")
-        message = get_llm_chain(
-            llm=get_new_llm().bind_tools([self.db_query_tool], tool_choice="required"),
-            prompt_file=prompt_file,
+        if self.use_schema_cache and state["get_schema_tool_result"] is None:
+            state["list_tables_tool_result"], state["get_schema_tool_result"] = WorkFlow.sqLite.get_schema_snapshot()
+
+        # 之前生成的SQL被拒绝的原因，重新生成时提供给大模型
+        state["tool_feedback"] = [f"SQL：{query}\n{result}" for query, result in self._query_results(state)
+                                  if result.startswith(QUERY_ERROR_PREFIX)]
+
+        return dict(
+            llm=self.query_llm,
+            prompt_file=get_prompt_file("sql_generate.txt"),
             require=state["require"],
             list_tables_tool_result=state["list_tables_tool_result"],
             get_schema_tool_result=state["get_schema_tool_result"],
             user_name=state["user_name"],
+            user_id="" if state.get("user_id") is None else state["user_id"],
             current_time=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            history=state.get("history", ""),
+            tool_feedback="\n".join(state["tool_feedback"]),
             logger=self.logger
         )
+
+    def query_gen_node(self, state: AgentState):
+        message = get_llm_chain(**self._query_gen_chain(state))
+        return {"messages": [message]}
+
+    async def aquery_gen_node(self, state: AgentState):
+        message = await aget_llm_chain(**self._query_gen_chain(state))
         return {"messages": [message]}
 
     @staticmethod
     @tool
-    def db_query_tool(query: str) -> str:
+    def db_query_tool(query: str, user_id: Annotated[Optional[int], InjectedState("user_id")] = None) -> str:
         """
         执行SQL查询并返回结果。
         
         该工具接收SQL查询语句，连接到数据库执行查询，并返回查询结果或执行状态。
-        对于SELECT查询，返回查询结果；对于其他类型的查询（如INSERT、UPDATE、DELETE），
-        返回执行状态和受影响的行数。
+        对于SELECT查询，返回查询结果（行数和大小有上限的紧凑表格，超出时附带分组汇总）；
+        对于其他类型的查询（如INSERT、UPDATE、DELETE），返回执行状态和受影响的行数。
+        不允许执行的语句、会扫描或访问其他用户记录的语句和超时的语句返回以"错误："开头的原因。
         
         参数:
             query: 要执行的SQL查询语句
@@ -208,55 +573,114 @@ class WorkFlow:
         返回:
             查询结果或执行状态信息
         """
+        # user_id 由 ToolNode 从工作流状态注入（InjectedState），不出现在给大模型的工具参数中
+        guard = WorkFlow.sqLite.query_guard
         try:
+            start = time.perf_counter()
+            if guard.statement_type(query) == "read":
+                # 查询在只读连接上执行
+                with WorkFlow.sqLite.connections.read() as connection:
+                    guard.check_plan(connection, query, user_id)
+                    with guard.time_budget(connection):
+                        result, rows = WorkFlow.result_shaper.shape_cursor(connection.execute(query))
+                tracer.record_sql(query, time.perf_counter() - start, rows)
+                return result
+
             sql_type = query.strip().split()[0].upper()
-            connection = WorkFlow.sqLite.conn
-            cursor = connection.cursor()
-
-            if sql_type == "SELECT":
-                cursor.execute(query)
-                result = cursor.fetchall()
-                cursor.close()
-                return result if result else "message: 没有查询到信息."
-
-            cursor.execute(query)
-            connection.commit()
-            affected_rows = cursor.rowcount
-            cursor.close()
+            affected_rows = WorkFlow.sqLite.execute_write(query, user_id)
+            tracer.record_sql(query, time.perf_counter() - start, affected_rows)
             return f"message: {sql_type} 成功，受影响行数: {affected_rows}"
 
+        except QueryRejected as e:
+            return f"{QUERY_ERROR_PREFIX}{e}"
         except SQLAlchemyError as e:
             return f"message: SQL 执行失败，错误信息: {str(e)}"
 
-    def model_check_query(self, state: AgentState) -> dict[str, list[AIMessage]]:
-        prompt_file = get_prompt_file("sql_check.txt")
-        message = get_llm_chain(
-            llm=get_new_llm().bind_tools([self.db_query_tool], tool_choice="required"),
-            prompt_file=prompt_file,
-            to_check_sql=state["messages"][-1].content,
-            logger=self.logger
-        )
-        return {"messages": [message]}
+    def validate_query(self, state):
+        """
+        在本地检查 query_gen 生成的SQL（SQLiteDB.validate_sql），不需要额外调用大模型
 
-    def judge_query(self, state):
-        prompt_file = get_prompt_file("judge_query.txt")
-        result = get_llm_chain(
-            llm=get_new_llm(),
-            prompt_file=prompt_file,
+        有SQL没有通过检查时，为这一批的每个工具调用返回以"错误："开头的结果，不再执行
+        """
+        messages = state.get("messages", [])
+        tool_calls = [tc for tc in getattr(messages[-1], "tool_calls", None) or [] if tc["name"] == "db_query_tool"] \
+            if messages else []
+        errors = {tc["id"]: WorkFlow.sqLite.validate_sql(tc["args"].get("query", "")) for tc in tool_calls}
+        if not any(errors.values()):
+            return {}
+        return {
+            "messages": [
+                ToolMessage(
+                    content=QUERY_ERROR_PREFIX + (errors[tc["id"]] or "同一次生成的其他SQL没有通过检查，这条SQL没有执行"),
+                    tool_call_id=tc["id"],
+                    name="db_query_tool",
+                )
+                for tc in tool_calls
+            ]
+        }
+
+    def should_execute_query(self, state) -> Literal["execute_query", "conclude", "query_gen"]:
+        messages = state.get("messages", [])
+        if messages and messages[-1].type == "tool":
+            return self.should_retry_query(state)
+        return "execute_query"
+
+    def _judge_locally(self, state):
+        intent, confidence, source = self.intent_router.classify(state.get("require"))
+        if intent is None:
+            return None, confidence
+        # 记录、查询、建议、登录都只依赖数据库
+        return {
+            "judge_result": "only_db",
+            "intent": intent,
+            "intent_confidence": confidence,
+            "intent_source": source,
+            "sql_plan": self.sql_templates.match(state.get("require"), intent)
+        }, confidence
+
+    def _judge_query_chain(self, state):
+        return dict(
+            llm=get_llm(),
+            prompt_file=get_prompt_file("judge_query.txt"),
             require=state.get("require"),
             logger=self.logger
         )
-        return {"judge_result": result.content}
+
+    def judge_query(self, state):
+        judged, confidence = self._judge_locally(state)
+        if judged is not None:
+            return judged
+        result = get_llm_chain(**self._judge_query_chain(state))
+        return {"judge_result": result.content, "intent": "", "intent_confidence": confidence, "intent_source": "llm"}
+
+    async def ajudge_query(self, state):
+        judged, confidence = self._judge_locally(state)
+        if judged is not None:
+            return judged
+        result = await aget_llm_chain(**self._judge_query_chain(state))
+        return {"judge_result": result.content, "intent": "", "intent_confidence": confidence, "intent_source": "llm"}
+
+    def template_query(self, state):
+        user_id = state.get("user_id")
+        if user_id is None:
+            return {"sql_plan": None}
+        sql_and_result = self.sql_templates.execute(state["sql_plan"], user_id)
+        return {"sql_and_result": sql_and_result}
+
+    def should_continue_template(self, state) -> Literal["conclude", "query_gen"]:
+        # 模板无法执行时回到大模型生成SQL的路径
+        return "conclude" if state.get("sql_plan") else "query_gen"
 
     def rag_retrieval(self, state):
         prompt_file = ""
-        result = get_llm_chain(llm=get_new_llm(), prompt_file=prompt_file, logger=self.logger)
+        result = get_llm_chain(llm=get_llm(), prompt_file=prompt_file, logger=self.logger)
         return result
 
-    def conclude(self, state):
-        state.setdefault("sql_and_result", [])
+    @staticmethod
+    def _query_results(state):
+        """返回 db_query_tool 每次调用的 (SQL语句, 执行结果)"""
         messages = state.get("messages", [])
-
+        results = []
         for message in messages:
             if message.type == "tool" and message.name == "db_query_tool":
                 tool_call_id = message.tool_call_id
@@ -264,28 +688,46 @@ class WorkFlow:
                     if msg.type == "ai" and msg.tool_calls:
                         for tc in msg.tool_calls:
                             if tc["id"] == tool_call_id:
-                                state["sql_and_result"].append({tc["args"]["query"]: message.content})
+                                results.append((tc["args"]["query"], message.content))
+        return results
+
+    def should_retry_query(self, state) -> Literal["conclude", "query_gen"]:
+        """最近一次执行的SQL被拒绝时回到 query_gen 重新生成，超过 MAX_QUERY_RETRIES 次后交给 conclude"""
+        results = self._query_results(state)
+        rejected = [result for _, result in results if result.startswith(QUERY_ERROR_PREFIX)]
+        if results and results[-1][1].startswith(QUERY_ERROR_PREFIX) and len(rejected) <= MAX_QUERY_RETRIES:
+            return "query_gen"
+        return "conclude"
+
+    def _conclude_chain(self, state):
+        state.setdefault("sql_and_result", [])
+        for query, result in self._query_results(state):
+            state["sql_and_result"].append({query: result})
 
-        prompt_file = get_prompt_file("conclude.txt")
-        message = get_llm_chain(
-            llm=get_new_llm().bind_tools([SubmitFinalAnswer]),
-            prompt_file=prompt_file,
+        return dict(
+            llm=self.conclude_llm,
+            prompt_file=get_prompt_file("conclude.txt"),
             require=state["require"],
-            sql_and_result=state["sql_and_result"],
+            sql_and_result=format_sql_and_result(state["sql_and_result"]),
+            history=state.get("history", ""),
             logger=self.logger
         )
 
-        if message.tool_calls:
-            for tc in message.tool_calls:
-                if tc["name"] == "SubmitFinalAnswer":
-                    state["user_name"] = tc["args"]["final_answer"].get("user_name", state["user_name"])
+    def conclude(self, state):
+        message = get_llm_chain(**self._conclude_chain(state))
+        return self._conclude_result(state, message)
 
-        return {"messages": [message], "user_name": state["user_name"]}
+    async def aconclude(self, state):
+        message = await aget_llm_chain(**self._conclude_chain(state))
+        return self._conclude_result(state, message)
 
-    def should_end(self, state: AgentState) -> Literal[END, "query_gen"]:
-        messages = state.get("messages", [])
-        if not messages:
-            return END
+    def _conclude_result(self, state, message):
+        user_id = state.get("user_id")
+        if message.tool_calls:
+            for tc in message.tool_calls:
+                if tc["name"] == "SubmitFinalAnswer" and "user_name" in tc["args"]["final_answer"]:
+                    # 大模型处理的登录请求，按登录后的用户名得到 user_id
+                    state["user_name"] = tc["args"]["final_answer"]["user_name"]
+                    user_id = WorkFlow.sqLite.login_user(state["user_name"]) if state["user_name"] else None
 
-        last_message = messages[-1]
-        return END if hasattr(last_message, "tool_calls") else "correct_query"
\ No newline at end of file
+        return {"messages": [message], "user_name": state["user_name"], "user_id": user_id}
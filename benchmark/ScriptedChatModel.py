@@ -0,0 +1,138 @@
+import asyncio
+import random
+import re
+import threading
+import time
+import uuid
+from typing import Any, List, Optional
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from pydantic import PrivateAttr
+
+LOGIN_PATTERN = re.compile(r"(登录|登陆|注册)\s*([A-Za-z0-9_\u4e00-\u9fff]+)")
+# 提示词模板中的用户输入部分，如"以下是用户输入的需求：\n{require}"
+REQUIRE_PATTERN = re.compile(r"以下是用户输入的(?:需求|信息)：\s*(.*?)\s*(?:以下是|当前时间是|请根据|$)", re.S)
+USER_NAME_PATTERN = re.compile(r"user_name: (\S*)")
+USER_ID_PATTERN = re.compile(r"user_id: (\d+)")
+RECORD_PATTERN = re.compile(r"(吃了|喝了|早餐|午餐|晚餐)")
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    用于基准测试的本地脚本化聊天模型
+
+    不访问网络，根据绑定的工具和提示词内容返回确定的工具调用：
+    - 绑定 sql_db_list_tables（登录节点）：请求中有"登录/注册xxx"时调用 sql_db_list_tables，否则直接回答
+    - 绑定 sql_db_schema：查询 users、meals、food_categories 的表结构
+    - 绑定 db_query_tool：按请求生成登录、注册、记录或查询的SQL
+    - 绑定 SubmitFinalAnswer（总结节点）：提交固定格式的回答
+    - 未绑定工具（意图判断）：返回 only_db
+    每次调用前等待 latency 秒（±jitter 比例的随机抖动，随机数由 seed 决定），模拟远程模型的耗时。
+    """
+
+    latency: float = 0.0
+    jitter: float = 0.0
+    seed: int = 0
+    tool_names: List[str] = []
+    _rng: Any = PrivateAttr(default=None)
+    _rng_lock: Any = PrivateAttr(default=None)
+
+    def model_post_init(self, __context):
+        self._rng = random.Random(self.seed)
+        self._rng_lock = threading.Lock()
+
+    @property
+    def _llm_type(self):
+        return "scripted"
+
+    def bind_tools(self, tools, **kwargs):
+        names = [getattr(tool, "name", None) or getattr(tool, "__name__", None) for tool in tools]
+        bound = self.model_copy(update={"tool_names": names})
+        # 绑定后的模型共用同一个随机数序列
+        bound._rng, bound._rng_lock = self._rng, self._rng_lock
+        return bound
+
+    def _delay(self):
+        if not self.latency:
+            return 0.0
+        with self._rng_lock:
+            factor = 1 + self._rng.uniform(-self.jitter, self.jitter)
+        return max(self.latency * factor, 0.0)
+
+    @staticmethod
+    def _tool_call(name, args):
+        return AIMessage(content="", tool_calls=[{"name": name, "args": args, "id": f"call_{uuid.uuid4().hex[:12]}"}])
+
+    @staticmethod
+    def _require(prompt):
+        match = REQUIRE_PATTERN.search(prompt)
+        return match.group(1) if match else prompt
+
+    def _generate_sql(self, prompt):
+        require = self._require(prompt)
+        match = USER_ID_PATTERN.search(prompt)
+        user_id = match.group(1) if match else None
+        login = LOGIN_PATTERN.search(require)
+        if login:
+            name = login.group(2)
+            if login.group(1) == "注册":
+                return f"INSERT OR IGNORE INTO users (user_name) VALUES ('{name}')"
+            return f"SELECT * FROM users WHERE user_name = '{name}'"
+        if user_id is None:
+            match = USER_NAME_PATTERN.search(prompt)
+            user_id = f"(SELECT user_id FROM users WHERE user_name = '{match.group(1) if match else ''}')"
+        if RECORD_PATTERN.search(require) and "什么" not in require:
+            return ("INSERT INTO meals (meal_date, meal_type, food_name, category_id, user_id) "
+                    f"VALUES (CURRENT_DATE, 'snack', '测试食物', 1, {user_id})")
+        return ("SELECT m.meal_date, m.meal_type, m.food_name, fc.category_name FROM meals m "
+                "LEFT JOIN food_categories fc ON m.category_id = fc.category_id "
+                f"WHERE m.user_id = {user_id} ORDER BY m.meal_date DESC LIMIT 50")
+
+    def _respond(self, messages):
+        prompt = messages[-1].content if messages else ""
+        prompt = prompt if isinstance(prompt, str) else str(prompt)
+        if "sql_db_list_tables" in self.tool_names:
+            if LOGIN_PATTERN.search(self._require(prompt)):
+                message = self._tool_call("sql_db_list_tables", {})
+            else:
+                message = self._tool_call("SubmitFinalAnswer", {"final_answer": {"message": "请先登录或注册。"}})
+        elif "sql_db_schema" in self.tool_names:
+            message = self._tool_call("sql_db_schema", {"table_names": "users, meals, food_categories"})
+        elif "db_query_tool" in self.tool_names:
+            message = self._tool_call("db_query_tool", {"query": self._generate_sql(prompt)})
+        elif "SubmitFinalAnswer" in self.tool_names:
+            final_answer = {"message": "已根据查询结果完成处理。"}
+            login = LOGIN_PATTERN.search(self._require(prompt))
+            if login:
+                final_answer["user_name"] = login.group(2)
+            message = self._tool_call("SubmitFinalAnswer", {"final_answer": final_answer})
+        else:
+            message = AIMessage(content="only_db")
+        # 按字符数估算的 token 用量，便于统计提示词大小
+        message.usage_metadata = {
+            "input_tokens": sum(len(str(m.content)) for m in messages),
+            "output_tokens": len(str(message.content)) + len(str(message.tool_calls)),
+        }
+        message.usage_metadata["total_tokens"] = sum(message.usage_metadata.values())
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs):
+        time.sleep(self._delay())
+        return self._respond(messages)
+
+    async def _agenerate(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs):
+        await asyncio.sleep(self._delay())
+        return self._respond(messages)
+
+
+def install(model):
+    """
+    让 utils.LLMUtil 创建的所有模型都使用给定的脚本化模型，需要在创建 WorkFlow 之前调用
+    """
+    import utils.LLMUtil as LLMUtil
+
+    LLMUtil.get_new_llm = lambda name="default", **kwargs: model
+    LLMUtil.model_registry._models.clear()
+    LLMUtil.model_registry._bound.clear()
@@ -0,0 +1,273 @@
+"""
+WorkFlow 离线基准测试
+
+用本地脚本化模型（benchmark.ScriptedChatModel）替换 utils.LLMUtil.get_new_llm，
+把请求语料逐条通过 WorkFlow.run 回放，数据库使用临时目录中的副本，不会修改原文件。
+统计吞吐量、端到端延迟和每个节点的耗时（p50/p95/p99），以及每个节点估算的提示词大小
+（固定前缀 / 随请求变化的部分），结果保存为JSON，
+可以用 --compare 与之前的结果对比。
+
+语料为JSONL，每行包含 require（或 text），可选 user_name、style。
+
+用法:
+    python -m benchmark.run_benchmark --latency 0.2 --repeat 5
+    python -m benchmark.run_benchmark --corpus my_requests.jsonl --concurrency 8 --compare benchmark/results/old.json
+"""
+import argparse
+import json
+import math
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from benchmark.ScriptedChatModel import ScriptedChatModel, install
+from utils.PromptRegistry import prompt_size
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus.jsonl")
+DEFAULT_OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+DEFAULT_USER = "bench"
+ERROR_PREFIX = "处理响应时出错"
+
+
+class NodeTimer(BaseCallbackHandler):
+    """记录工作流中每个节点的耗时、模型调用次数和提示词大小"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._starts = {}
+        self.durations = defaultdict(list)
+        self.prompt_prefix_tokens = defaultdict(list)
+        self.prompt_request_tokens = defaultdict(list)
+        self.llm_calls = 0
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        node = (metadata or {}).get("langgraph_node")
+        # 节点内部的子链也带有相同的 langgraph_node（RunnableLambda 节点内部还有一层同名的链），只统计最外层
+        if not node or node.startswith("__") or kwargs.get("name") != node or parent_run_id in self._starts:
+            return
+        self._starts[run_id] = (node, time.perf_counter())
+
+    def _finish(self, run_id):
+        started = self._starts.pop(run_id, None)
+        if started is not None:
+            node, start = started
+            with self._lock:
+                self.durations[node].append(time.perf_counter() - start)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        node = (metadata or {}).get("langgraph_node", "")
+        prefix_tokens, request_tokens = prompt_size(messages[0] if messages else [])
+        with self._lock:
+            self.llm_calls += 1
+            self.prompt_prefix_tokens[node].append(prefix_tokens)
+            self.prompt_request_tokens[node].append(request_tokens)
+
+
+def load_corpus(path, default_user=DEFAULT_USER):
+    corpus = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            require = item.get("require") or item.get("text")
+            if not require:
+                continue
+            corpus.append({
+                "require": require,
+                "user_name": item.get("user_name", default_user),
+                "style": item.get("style", "轻松"),
+            })
+    return corpus
+
+
+def prepare_db(source, workdir):
+    """
+    在临时目录中准备数据库副本
+
+    source 是有效的SQLite文件时用 backup 复制（包括WAL中尚未合并的数据），否则使用空数据库
+    """
+    target = os.path.join(workdir, "benchmark.db")
+    if source and os.path.exists(source):
+        try:
+            with sqlite3.connect(f"file:{source}?mode=ro", uri=True) as src, sqlite3.connect(target) as dst:
+                src.backup(dst)
+        except sqlite3.DatabaseError as e:
+            print(f"无法复制数据库 {source}（{e}），使用空数据库")
+            if os.path.exists(target):
+                os.remove(target)
+    return target
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    # 最近秩法
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def summarize(values):
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values),
+    }
+
+
+def run_benchmark(corpus, db_source=None, latency=0.0, jitter=0.0, seed=0, repeat=1, concurrency=1,
+                  use_schema_cache=True, response_cache=False):
+    """
+    回放语料并返回统计结果（可直接保存为JSON）
+    """
+    # 导入放在这里，保证 install() 在 WorkFlow 绑定模型之前执行
+    from agent.workflow import WorkFlow
+    from db.SQLiteDB import SQLiteDB
+
+    install(ScriptedChatModel(latency=latency, jitter=jitter, seed=seed))
+    workdir = tempfile.mkdtemp(prefix="healtheat-bench-")
+    try:
+        sqLite = SQLiteDB(prepare_db(db_source, workdir))
+        for user_name in {item["user_name"] for item in corpus if item["user_name"]}:
+            sqLite.register_user(user_name)
+
+        cache = None
+        if response_cache:
+            from db.ResponseCache import ResponseCache
+            cache = ResponseCache(db_path=os.path.join(workdir, "responseCache.db"))
+
+        timer = NodeTimer()
+        workflow = WorkFlow(sqLite, use_schema_cache=use_schema_cache, response_cache=cache, callbacks=[timer])
+        requests = corpus * repeat
+        latencies = [0.0] * len(requests)
+        errors = []
+
+        def replay(index):
+            start = time.perf_counter()
+            _, message = workflow.run(dict(requests[index]))
+            latencies[index] = time.perf_counter() - start
+            if message.startswith(ERROR_PREFIX):
+                errors.append({"require": requests[index]["require"], "message": message})
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(replay, range(len(requests))))
+        elapsed = time.perf_counter() - started
+
+        result = {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "config": {
+                "requests": len(requests), "corpus_size": len(corpus), "repeat": repeat,
+                "concurrency": concurrency, "latency": latency, "jitter": jitter, "seed": seed,
+                "use_schema_cache": use_schema_cache, "response_cache": response_cache,
+            },
+            "elapsed_seconds": elapsed,
+            "throughput_rps": len(requests) / elapsed if elapsed else None,
+            "llm_calls": timer.llm_calls,
+            "llm_calls_per_request": timer.llm_calls / len(requests) if requests else None,
+            "errors": errors,
+            "latency": summarize(latencies),
+            "nodes": {node: summarize(values) for node, values in sorted(timer.durations.items())},
+            "prompts": {
+                node: {"prefix_tokens": summarize(timer.prompt_prefix_tokens[node]),
+                       "request_tokens": summarize(values)}
+                for node, values in sorted(timer.prompt_request_tokens.items())
+            },
+        }
+        if cache is not None:
+            result["response_cache"] = cache.stats()
+            cache.close()
+        sqLite.close()
+        return result
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def compare(current, previous):
+    """打印两次结果的主要指标变化"""
+    rows = [("throughput_rps", current.get("throughput_rps"), previous.get("throughput_rps"))]
+    for key in ("p50", "p95", "p99"):
+        rows.append((f"latency.{key}", current["latency"].get(key), previous["latency"].get(key)))
+    for node in sorted(set(current["nodes"]) | set(previous["nodes"])):
+        rows.append((f"{node}.p50", current["nodes"].get(node, {}).get("p50"),
+                     previous["nodes"].get(node, {}).get("p50")))
+    current_prompts, previous_prompts = current.get("prompts", {}), previous.get("prompts", {})
+    for node in sorted(set(current_prompts) | set(previous_prompts)):
+        for part in ("prefix_tokens", "request_tokens"):
+            rows.append((f"{node}.{part}.mean", current_prompts.get(node, {}).get(part, {}).get("mean"),
+                         previous_prompts.get(node, {}).get(part, {}).get("mean")))
+    for name, now, before in rows:
+        if now is None or before is None:
+            before, now = (f"{v:.4f}" if v is not None else "-" for v in (before, now))
+            print(f"{name:<32} {before:>10} -> {now:>10}")
+            continue
+        change = (now - before) / before * 100 if before else 0.0
+        print(f"{name:<32} {before:>10.4f} -> {now:>10.4f} ({change:+.1f}%)")
+
+
+def print_summary(result):
+    latency = result["latency"]
+    print(f"请求数: {result['config']['requests']}，耗时: {result['elapsed_seconds']:.2f}s，"
+          f"吞吐量: {result['throughput_rps']:.2f} req/s，模型调用: {result['llm_calls']}，错误: {len(result['errors'])}")
+    print(f"端到端延迟 p50={latency['p50']:.4f}s p95={latency['p95']:.4f}s p99={latency['p99']:.4f}s")
+    for node, stats in result["nodes"].items():
+        print(f"  {node:<20} n={stats['count']:<6} p50={stats['p50']:.4f}s p95={stats['p95']:.4f}s "
+              f"p99={stats['p99']:.4f}s")
+    if result.get("prompts"):
+        print("提示词大小（估算token数，均值）:")
+    for node, sizes in result.get("prompts", {}).items():
+        prefix, request = sizes["prefix_tokens"]["mean"], sizes["request_tokens"]["mean"]
+        print(f"  {node:<20} 固定前缀={prefix:<8.0f} 随请求变化={request:<8.0f} "
+              f"可缓存比例={prefix / (prefix + request) if prefix + request else 0:.0%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="使用本地脚本化模型对 WorkFlow 进行基准测试")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="请求语料JSONL文件")
+    parser.add_argument("--db", default="db/healthMealAssistant.db", help="复制到临时目录使用的数据库文件")
+    parser.add_argument("--latency", type=float, default=0.0, help="每次模型调用模拟的耗时（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="耗时的随机抖动比例（0~1）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=1, help="语料重复回放的次数")
+    parser.add_argument("--concurrency", type=int, default=1, help="同时回放的请求数")
+    parser.add_argument("--no-schema-cache", action="store_true", help="关闭表结构快照，走完整的表结构发现流程")
+    parser.add_argument("--response-cache", action="store_true", help="启用回答缓存")
+    parser.add_argument("--output", help="结果JSON路径，默认保存到 benchmark/results/")
+    parser.add_argument("--compare", help="与之前保存的结果JSON对比")
+    args = parser.parse_args()
+
+    result = run_benchmark(
+        load_corpus(args.corpus), db_source=args.db, latency=args.latency, jitter=args.jitter, seed=args.seed,
+        repeat=args.repeat, concurrency=args.concurrency, use_schema_cache=not args.no_schema_cache,
+        response_cache=args.response_cache
+    )
+    output = args.output or os.path.join(DEFAULT_OUTPUT_DIR, f"benchmark-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    print_summary(result)
+    print(f"结果已保存到 {output}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(result, json.load(f))
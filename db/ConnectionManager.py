@@ -0,0 +1,75 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class ConnectionManager:
+    """
+    SQLite连接管理
+
+    - 数据库使用WAL日志模式，读操作不会被写操作阻塞
+    - 每个线程持有一个只读连接，读操作之间可以并行
+    - 只有一个写连接，由锁串行化，每次写入都在 BEGIN IMMEDIATE 事务中完成，
+      避免多个线程的提交交错
+    - 所有连接都设置了 busy_timeout，遇到其他进程持有锁时等待而不是直接报 "database is locked"
+    """
+
+    def __init__(self, db_path: str, busy_timeout_ms: int = 5000):
+        self.db_path = db_path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        self._readers = []
+        self._readers_lock = threading.Lock()
+        self._write_lock = threading.RLock()
+        # isolation_level=None：由 write() 显式控制事务
+        self.writer = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._configure(self.writer)
+        self.writer.execute("PRAGMA journal_mode=WAL")
+        self.writer.execute("PRAGMA synchronous=NORMAL")
+
+    def _configure(self, conn):
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+
+    def _reader(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True,
+                                   check_same_thread=False, isolation_level=None)
+            self._configure(conn)
+            self._local.conn = conn
+            with self._readers_lock:
+                self._readers.append(conn)
+        return conn
+
+    @contextmanager
+    def read(self):
+        """获取当前线程的只读连接"""
+        yield self._reader()
+
+    @contextmanager
+    def write(self):
+        """
+        获取写连接并开启事务，正常退出时提交，出现异常时回滚
+
+        同一线程内可以嵌套调用，嵌套的 write() 加入外层事务
+        """
+        with self._write_lock:
+            if self.writer.in_transaction:
+                yield self.writer
+                return
+            self.writer.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.writer
+            except BaseException:
+                self.writer.execute("ROLLBACK")
+                raise
+            else:
+                self.writer.execute("COMMIT")
+
+    def close(self):
+        with self._readers_lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers.clear()
+        with self._write_lock:
+            self.writer.close()
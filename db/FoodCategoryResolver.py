@@ -0,0 +1,164 @@
+import difflib
+import threading
+import time
+from collections import Counter, defaultdict
+
+# 食物关键词 -> 类别名称（与 food_categories 的默认类别一致）
+SEED_FOOD_CATEGORIES = {
+    "蔬菜类": ("西红柿", "番茄", "青菜", "白菜", "菠菜", "生菜", "黄瓜", "胡萝卜", "土豆", "茄子", "西兰花",
+              "芹菜", "蘑菇", "青椒", "豆角", "南瓜", "冬瓜", "沙拉", "蔬菜"),
+    "水果类": ("苹果", "香蕉", "橙子", "橘子", "葡萄", "西瓜", "草莓", "梨", "鸭梨", "桃", "芒果", "猕猴桃", "蓝莓", "水果"),
+    "谷物类": ("燕麦", "米饭", "粥", "面条", "面包", "馒头", "包子", "饺子", "玉米", "米粉", "面", "饭"),
+    "肉蛋类": ("鸡蛋", "鸡肉", "鸡腿", "鸡胸", "牛肉", "猪肉", "羊肉", "排骨", "鸭", "蛋", "肉"),
+    "奶制品": ("牛奶", "酸奶", "奶酪", "芝士", "奶"),
+    "豆制品": ("豆腐", "豆浆", "豆干", "腐竹", "豆"),
+    "坚果类": ("核桃", "杏仁", "花生", "腰果", "开心果", "坚果", "瓜子"),
+    "海鲜类": ("鱼", "虾", "蟹", "贝", "海带", "紫菜", "鱿鱼", "海鲜"),
+}
+# 包含单字关键词但不属于对应类别的词，如"鱼香肉丝"不是海鲜、"蛋糕"不是肉蛋，命中时其中的单字关键词不再计算
+EXCLUDED_KEYWORDS = ("鱼香", "蛋糕", "蛋挞", "蛋卷", "奶茶", "奶油", "贝果", "桃酥")
+
+
+class FoodCategoryResolver:
+    """
+    本地食物名称 -> 类别ID 解析
+
+    依次尝试：
+    1. 精确匹配：meals 表中出现过的食物名称，取该名称最常用的类别
+    2. 关键词匹配：在字典树中查找食物名称里出现的所有关键词（种子字典和学到的食物名称），
+       取最长的一个，如"西红柿炒鸡蛋"命中"西红柿"；EXCLUDED_KEYWORDS 覆盖的单字关键词不算，
+       最长的关键词有多个且类别不同时（如"燕麦粥和牛奶"）视为无法判断
+    3. 模糊匹配：在首字相同、长度相近的已知名称（最多 max_fuzzy_candidates 个）中，
+       相似度不低于 fuzzy_cutoff 时使用最相近的一个
+    都失败时返回None，由调用方交给大模型判断；大模型写入的记录之后也会被学到，
+    本地推断类别后写入的记录（category_guessed = 1）不会被学习。
+    """
+
+    def __init__(self, sqLite, seed=None, fuzzy_cutoff=0.75, refresh_seconds=30, learn_batch=10000,
+                 max_fuzzy_candidates=200):
+        self.sqLite = sqLite
+        self.seed = seed if seed is not None else SEED_FOOD_CATEGORIES
+        self.fuzzy_cutoff = fuzzy_cutoff
+        # 两次增量学习之间的最短间隔；有未学习完的积压时不受限制
+        self.refresh_seconds = refresh_seconds
+        # 每次学习最多读取的 meal_id 范围，批量导入之后分多次学完
+        self.learn_batch = learn_batch
+        self.max_fuzzy_candidates = max_fuzzy_candidates
+        self._lock = threading.Lock()
+        self._learned = {}
+        self._last_meal_id = 0
+        self._refreshed_at = None
+        self._trie = {}
+        self._names = {}
+        # (首字, 长度) -> 名称列表，模糊匹配只在长度相近的同首字名称中查找
+        self._buckets = defaultdict(list)
+        self._loaded = False
+
+    def _insert(self, name, category_id):
+        node = self._trie
+        for char in name:
+            node = node.setdefault(char, {})
+        node[None] = category_id
+        if category_id is None:
+            return
+        if name not in self._names:
+            self._buckets[(name[0], len(name))].append(name)
+        self._names[name] = category_id
+
+    def _load_seed(self):
+        for keyword in EXCLUDED_KEYWORDS:
+            self._insert(keyword, None)
+        category_ids = self.sqLite.get_category_ids()
+        for category_name, keywords in self.seed.items():
+            category_id = category_ids.get(category_name)
+            if category_id is None:
+                continue
+            for keyword in keywords:
+                self._insert(keyword, category_id)
+
+    def refresh(self, force=False):
+        """
+        增量学习 meals 表中新写入的 食物名称 -> 类别 对应关系
+
+        每次最多读取 learn_batch 个 meal_id，全部学完后 refresh_seconds 内不再查询数据库，
+        force=True 时忽略时间间隔
+        """
+        with self._lock:
+            if not self._loaded:
+                self._load_seed()
+                self._loaded = True
+            now = time.monotonic()
+            if not force and self._refreshed_at is not None and now - self._refreshed_at < self.refresh_seconds:
+                return
+            with self.sqLite.connections.read() as conn:
+                max_meal_id = conn.execute("SELECT MAX(meal_id) FROM meals").fetchone()[0] or 0
+                upper = max(self._last_meal_id, min(max_meal_id, self._last_meal_id + self.learn_batch))
+                rows = conn.execute(
+                    "SELECT food_name, category_id, COUNT(*) FROM meals "
+                    "WHERE meal_id > ? AND meal_id <= ? AND category_id IS NOT NULL AND category_guessed = 0 "
+                    "GROUP BY food_name, category_id",
+                    (self._last_meal_id, upper)
+                ).fetchall()
+            self._last_meal_id = upper
+            # 还有积压时下一次调用继续学习
+            self._refreshed_at = now if upper >= max_meal_id else None
+            for food_name, category_id, count in rows:
+                food_name = food_name.strip()
+                if not food_name:
+                    continue
+                counts = self._learned.setdefault(food_name, Counter())
+                counts[category_id] += count
+                self._insert(food_name, counts.most_common(1)[0][0])
+
+    def _search(self, food_name):
+        hits = []
+        for start in range(len(food_name)):
+            node = self._trie
+            for end in range(start, len(food_name)):
+                node = node.get(food_name[end])
+                if node is None:
+                    break
+                if None in node:
+                    hits.append((start, end + 1, node[None]))
+        excluded = [(start, end) for start, end, category_id in hits if category_id is None]
+        # 与排除词部分重叠（没有完整覆盖排除词）的关键词不算，如"鱼香肉丝"中的"鱼"
+        hits = [
+            (end - start, category_id) for start, end, category_id in hits
+            if category_id is not None and not any(
+                start < ex_end and ex_start < end and not (start <= ex_start and ex_end <= end)
+                for ex_start, ex_end in excluded
+            )
+        ]
+        if not hits:
+            return None
+        longest = max(length for length, _ in hits)
+        categories = {category_id for length, category_id in hits if length == longest}
+        return categories.pop() if len(categories) == 1 else None
+
+    def resolve(self, food_name):
+        """
+        解析食物名称对应的类别ID
+
+        返回:
+            int或None: 类别ID，无法判断时返回None
+        """
+        food_name = (food_name or "").strip()
+        if not food_name:
+            return None
+        self.refresh()
+        if food_name in self._names:
+            return self._names[food_name]
+        category_id = self._search(food_name)
+        if category_id is not None:
+            return category_id
+        matches = difflib.get_close_matches(food_name, self._fuzzy_candidates(food_name), n=1, cutoff=self.fuzzy_cutoff)
+        return self._names[matches[0]] if matches else None
+
+    def _fuzzy_candidates(self, food_name):
+        candidates = []
+        length = len(food_name)
+        for candidate_length in sorted(range(max(1, length - 2), length + 3), key=lambda n: abs(n - length)):
+            candidates += self._buckets.get((food_name[0], candidate_length), ())
+            if len(candidates) >= self.max_fuzzy_candidates:
+                break
+        return candidates[:self.max_fuzzy_candidates]
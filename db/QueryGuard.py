@@ -0,0 +1,231 @@
+import re
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from db.SqlValidator import split_top_level, value_tuples
+
+# 数据量随用户增长的表，访问时必须能按 user_id 定位
+GUARDED_TABLES = ("meals", "meal_category_daily", "meal_category_weekly")
+READ_KEYWORDS = ("SELECT", "WITH")
+WRITE_KEYWORDS = ("INSERT", "UPDATE", "DELETE", "REPLACE")
+TABLE_REFERENCE_PATTERN = re.compile(
+    r"\b(?:FROM|JOIN|UPDATE|INTO)\s+[\"`]?(\w+)[\"`]?(?:\s+(?:AS\s+)?([A-Za-z_]\w*))?", re.I
+)
+# 表名后面可能紧跟的关键字，不是别名
+NOT_ALIAS = {
+    "where", "join", "left", "right", "inner", "outer", "cross", "natural", "on", "using", "group", "order",
+    "limit", "set", "values", "select", "default", "union", "except", "intersect", "having", "window", "returning",
+}
+PLAN_PATTERN = re.compile(r"^(SCAN|SEARCH) (\w+)")
+# "m.user_id = 3" 这类 user_id 等值条件，value 是等号右边的字面值、参数或表达式的开头
+USER_FILTER_PATTERN = re.compile(r"(?:\b(\w+)\s*\.\s*)?\buser_id\s*==?\s*(?P<value>'?-?\d+'?|\?|:\w+|\(|[\w.]+)", re.I)
+USER_ID_LITERAL_PATTERN = re.compile(r"'?(-?\d+)'?")
+STRING_LITERAL_PATTERN = re.compile(r"'(?:[^']|'')*'")
+# 条件所在子句的边界
+CLAUSE_PATTERN = re.compile(
+    r"\b(?:WHERE|ON|JOIN|GROUP\s+BY|ORDER\s+BY|HAVING|LIMIT|UNION|EXCEPT|INTERSECT|SELECT|FROM|SET|VALUES|RETURNING)\b",
+    re.I
+)
+OR_PATTERN = re.compile(r"\bOR\b", re.I)
+INSERT_VALUES_PATTERN = re.compile(
+    r"^\s*(?:INSERT|REPLACE)\s+(?:OR\s+\w+\s+)?INTO\s+[\"`]?(\w+)[\"`]?\s*\(([^)]*)\)\s*VALUES\s*(.*)$", re.I | re.S
+)
+MULTIPLE_STATEMENTS_MESSAGE = "一次只能执行一条SQL语句，多条语句请分别调用工具"
+
+
+class QueryRejected(Exception):
+    """大模型生成的SQL没有通过检查，错误信息会返回给大模型用于重新生成"""
+
+
+class QueryGuard:
+    """
+    大模型生成SQL的执行保护
+
+    - 只允许 SELECT/WITH 查询和 INSERT/UPDATE/DELETE/REPLACE 写入，其他语句（DDL、PRAGMA、ATTACH 等）直接拒绝；
+      查询在只读连接上执行，查询中夹带写操作时同样被拒绝
+    - 执行前用 EXPLAIN QUERY PLAN 检查执行计划，对 GUARDED_TABLES 的全表扫描会被拒绝；按索引访问时
+      语句中必须对该表写了 user_id = 当前用户 的条件，且不能用 OR 与其他条件连接（只按 meal_id 定位同样被拒绝），
+      写入其他用户的 user_id 也会被拒绝
+    - 通过 SQLite 的 progress handler 限制每条语句的执行时间，超过 max_seconds 时中止
+    """
+
+    def __init__(self, max_seconds=2.0, progress_steps=1000, guarded_tables=GUARDED_TABLES):
+        self.max_seconds = max_seconds
+        # 每执行这么多条虚拟机指令检查一次是否超时
+        self.progress_steps = progress_steps
+        self.guarded_tables = set(guarded_tables)
+
+    @staticmethod
+    def statement_type(query):
+        """
+        返回:
+            str: "read" 或 "write"
+
+        异常:
+            QueryRejected: 不允许执行的语句
+        """
+        words = query.strip().split(None, 1)
+        keyword = words[0].upper() if words else ""
+        if keyword in READ_KEYWORDS:
+            return "read"
+        if keyword in WRITE_KEYWORDS:
+            return "write"
+        raise QueryRejected(f"不允许执行 {keyword or '空'} 语句，只能使用 SELECT 查询或 INSERT/UPDATE/DELETE 写入")
+
+    def _guarded_names(self, query):
+        """查询中引用受保护表时使用的名称（表名和别名）-> 表名"""
+        names = {}
+        for table, alias in TABLE_REFERENCE_PATTERN.findall(query):
+            table = table.lower()
+            if table not in self.guarded_tables:
+                continue
+            names[table] = table
+            if alias and alias.lower() not in NOT_ALIAS:
+                names[alias.lower()] = table
+        return names
+
+    @staticmethod
+    def _or_joined(masked, start, end):
+        """masked[start:end] 处的条件是否在同一层括号、同一个子句中与 OR 连接"""
+        left, depth = start - 1, 0
+        while left >= 0:
+            if masked[left] == ")":
+                depth += 1
+            elif masked[left] == "(":
+                if depth == 0:
+                    break
+                depth -= 1
+            left -= 1
+        right, depth = end, 0
+        while right < len(masked):
+            if masked[right] == "(":
+                depth += 1
+            elif masked[right] == ")":
+                if depth == 0:
+                    break
+                depth -= 1
+            right += 1
+        # 只保留同一层的内容，内层括号中的 OR 不影响这个条件
+        chars, depth = [], 0
+        for char in masked[left + 1:right]:
+            if char == "(":
+                depth += 1
+            chars.append(char if depth == 0 and char != ")" else " ")
+            if char == ")":
+                depth -= 1
+        region = "".join(chars)
+        position = start - left - 1
+        boundaries = [m.start() for m in CLAUSE_PATTERN.finditer(region)]
+        clause_start = max([b for b in boundaries if b <= position], default=0)
+        clause_end = min([b for b in boundaries if b > position], default=len(region))
+        return bool(OR_PATTERN.search(region[clause_start:clause_end]))
+
+    def _user_filtered(self, query, names, user_id):
+        """
+        返回语句中按当前用户过滤的受保护表名称（表名或别名），没写前缀的条件只在语句只引用了一个受保护表时算数
+
+        异常:
+            QueryRejected: user_id 条件的值不是当前用户，或条件与 OR 连接
+        """
+        masked = STRING_LITERAL_PATTERN.sub(lambda m: "'" + " " * (len(m.group()) - 2) + "'", query)
+        single = len(set(names.values())) == 1
+        filtered = set()
+        for match in USER_FILTER_PATTERN.finditer(query):
+            qualifier = match.group(1)
+            if qualifier:
+                targets = {qualifier.lower()} & names.keys()
+            else:
+                targets = set(names) if single else set()
+            literal = USER_ID_LITERAL_PATTERN.fullmatch(match.group("value"))
+            if not targets or literal is None:
+                continue
+            if int(literal.group(1)) != user_id:
+                raise QueryRejected(f"只能访问当前用户的记录，user_id 必须是 {user_id}")
+            if self._or_joined(masked, match.start(), match.end()):
+                raise QueryRejected("user_id 条件不能用 OR 与其他条件连接，否则会访问到其他用户的记录，"
+                                    "请把其他条件放在括号中，如 user_id = 当前用户的 user_id AND (a OR b)")
+            filtered |= targets
+        return filtered
+
+    def _check_insert(self, query, user_id):
+        """INSERT ... VALUES 写入受保护表时，每一行的 user_id 必须是当前用户"""
+        insert = INSERT_VALUES_PATTERN.match(query)
+        if insert is None or insert.group(1).lower() not in self.guarded_tables:
+            return
+        columns = [c.strip().strip('"`').lower() for c in insert.group(2).split(",")]
+        if "user_id" not in columns:
+            return
+        index = columns.index("user_id")
+        for group in value_tuples(insert.group(3)):
+            items = split_top_level(group)
+            literal = USER_ID_LITERAL_PATTERN.fullmatch(items[index]) if index < len(items) else None
+            if literal is None or int(literal.group(1)) != user_id:
+                raise QueryRejected(f"只能写入当前用户的记录，user_id 请直接写 {user_id}")
+
+    def check_plan(self, connection, query, user_id=None):
+        """
+        用 EXPLAIN QUERY PLAN 检查执行计划
+
+        按索引访问受保护的表时，语句中必须对该表写了 user_id = 当前用户 的条件（执行计划中的
+        user_id=? 或 rowid=? 本身不能说明访问的是当前用户的记录），如
+        LEFT JOIN meals m ON m.category_id = c.category_id AND m.user_id = 3 走 category_id 索引也可以通过；
+        全表扫描总是被拒绝。
+
+        参数:
+            user_id (int): 当前登录用户的ID，为None时不能访问受保护的表
+
+        异常:
+            QueryRejected: 对受保护的表做了全表扫描、没有按当前用户过滤或访问了其他用户的记录
+        """
+        names = self._guarded_names(query)
+        if not names:
+            return
+        if user_id is None:
+            raise QueryRejected(f"当前没有登录的用户，不能访问 {', '.join(sorted(set(names.values())))} 表")
+        self._check_insert(query, user_id)
+        filtered = self._user_filtered(query, names, user_id)
+        try:
+            plan = connection.execute(f"EXPLAIN QUERY PLAN {query}").fetchall()
+        except sqlite3.ProgrammingError as e:
+            if "one statement" not in str(e):
+                raise
+            raise QueryRejected(MULTIPLE_STATEMENTS_MESSAGE) from e
+        for row in plan:
+            detail = row[-1]
+            match = PLAN_PATTERN.match(detail)
+            if match is None or match.group(2).lower() not in names:
+                continue
+            name = match.group(2)
+            table = names[name.lower()]
+            if match.group(1) == "SCAN":
+                raise QueryRejected(
+                    f"查询会全表扫描 {table} 表中所有用户的记录（执行计划：{detail}），"
+                    f"请加上按用户过滤的条件，如 {name}.user_id = {user_id}"
+                )
+            if name.lower() in filtered:
+                continue
+            raise QueryRejected(
+                f"查询访问 {table} 表时没有限定当前用户（执行计划：{detail}），"
+                f"请在 {name} 的条件中加上 {name}.user_id = {user_id}"
+            )
+
+    @contextmanager
+    def time_budget(self, connection):
+        """在这个范围内执行的语句超过 max_seconds 时被中止"""
+        deadline = time.perf_counter() + self.max_seconds
+        connection.set_progress_handler(lambda: time.perf_counter() > deadline, self.progress_steps)
+        try:
+            yield
+        except sqlite3.OperationalError as e:
+            if "interrupted" in str(e):
+                raise QueryRejected(f"查询执行超过 {self.max_seconds:g} 秒被中止，请缩小查询范围或简化查询") from e
+            if "readonly" in str(e):
+                raise QueryRejected("查询语句中不能包含写入操作") from e
+            raise
+        except sqlite3.ProgrammingError as e:
+            if "one statement" not in str(e):
+                raise
+            raise QueryRejected(MULTIPLE_STATEMENTS_MESSAGE) from e
+        finally:
+            connection.set_progress_handler(None, 0)
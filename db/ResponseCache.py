@@ -0,0 +1,122 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import date
+
+
+class ResponseCache:
+    """
+    conclude 回答的持久化缓存
+
+    缓存键由规范化后的用户请求、user_id、回复风格、该用户的数据版本号、当天日期以及注入提示词的对话历史组成，
+    数据版本号在 meals 表每次写入时由触发器递增，因此用户记录新的饮食后旧答案自然失效；
+    "今天"、"这周"、"最近"这类相对日期的答案过了零点也不再命中；同样的追问在不同的对话上下文中也不会共用答案。
+    缓存保存在独立的SQLite文件中，按最近访问时间做LRU淘汰，并支持TTL过期和条目数上限。
+    """
+
+    def __init__(self, db_path="db/responseCache.db", max_entries=1000, ttl_seconds=24 * 3600):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self.conn as conn:
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS response_cache (
+                cache_key TEXT PRIMARY KEY,
+                user_id INTEGER,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            );
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_last_access ON response_cache (last_access)")
+
+    @staticmethod
+    def normalize(text):
+        # 去掉空白和句末标点，统一大小写，使"这周我吃了什么？"和"这周我吃了什么"命中同一条缓存
+        text = re.sub(r"\s+", "", text or "").lower()
+        return re.sub(r"[。！!？?.，,~～]+$", "", text)
+
+    @classmethod
+    def make_key(cls, require, user_id, style, data_version, day=None, history=""):
+        day = day or date.today()
+        raw = "\x1f".join([cls.normalize(require), str(user_id), style or "", str(data_version), day.isoformat(),
+                           history or ""])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT response, created_at FROM response_cache WHERE cache_key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl_seconds and now - row[1] > self.ttl_seconds:
+                with self.conn:
+                    self.conn.execute("DELETE FROM response_cache WHERE cache_key = ?", (key,))
+                self.evictions += 1
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            with self.conn:
+                self.conn.execute("UPDATE response_cache SET last_access = ? WHERE cache_key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, user_id, response):
+        now = time.time()
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO response_cache (cache_key, user_id, response, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, user_id, response, now, now)
+            )
+            if self.ttl_seconds:
+                cursor = self.conn.execute(
+                    "DELETE FROM response_cache WHERE created_at < ?", (now - self.ttl_seconds,)
+                )
+                self.evictions += cursor.rowcount
+            size = self.conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+            if size > self.max_entries:
+                cursor = self.conn.execute(
+                    "DELETE FROM response_cache WHERE cache_key IN "
+                    "(SELECT cache_key FROM response_cache ORDER BY last_access LIMIT ?)",
+                    (size - self.max_entries,)
+                )
+                self.evictions += cursor.rowcount
+
+    def invalidate_user(self, user_id):
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM response_cache WHERE user_id = ?", (user_id,))
+
+    def clear(self):
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM response_cache")
+
+    def stats(self):
+        """
+        获取缓存命中统计
+
+        返回:
+            dict: hits、misses、evictions、size 和 hit_rate
+        """
+        with self._lock:
+            size = self.conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": size,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0
+            }
+
+    def close(self):
+        self.conn.close()
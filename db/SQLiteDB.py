@@ -1,118 +1,98 @@
+import hashlib
+import json
 import sqlite3
 import os
+import time
+from collections import namedtuple
+from datetime import date, timedelta
+from itertools import islice
 from langchain_community.utilities import SQLDatabase
 
+from db.ConnectionManager import ConnectionManager
+from db.FoodCategoryResolver import FoodCategoryResolver
+from db.migrations import migrate
+from db.QueryGuard import QueryGuard
+from db.SchemaCache import SchemaCache
+from db.SqlValidator import SqlValidator
+
+# 暴露给大模型（SQLDatabase / 表结构快照）的业务表，内部维护用的表不出现在提示词中
+LLM_TABLES = ["users", "food_categories", "meals"]
+
+Meal = namedtuple("Meal", [
+    "meal_id", "meal_date", "meal_type", "food_name", "description",
+    "category_id", "category_name", "nutrition_value", "recommended_frequency"
+])
+MEAL_COLUMNS_SQL = """
+SELECT m.meal_id, m.meal_date, m.meal_type, m.food_name, m.description,
+       c.category_id, c.category_name, c.nutrition_value, c.recommended_frequency
+FROM meals m
+LEFT JOIN food_categories c ON m.category_id = c.category_id
+"""
+
 
 class SQLiteDB:
-    def __init__(self, db_name: str):
-        self.db_name = f"db/{db_name}"  
+    def __init__(self, db_name: str, write_idempotency_seconds: float = 30, query_seconds: float = 2.0):
+        # 相对路径放在 db/ 目录下，也可以传入绝对路径（如基准测试使用的临时数据库）
+        self.db_name = os.path.join("db", db_name)
         os.makedirs(os.path.dirname(self.db_name), exist_ok=True)
 
         db_exists = os.path.exists(self.db_name)
 
-        self.conn = sqlite3.connect(self.db_name, check_same_thread=False)
+        # 读写连接管理（WAL、每线程只读连接、单一串行写连接）
+        self.connections = ConnectionManager(self.db_name)
 
+        # 按 PRAGMA user_version 依次执行未应用的迁移，已有的数据库文件也会被原地升级
+        applied = migrate(self.connections)
         if not db_exists:
-            self._create_tables()
+            print("数据库和表已创建，默认食物类别已添加。")
+        elif applied:
+            print(f"数据库已升级到版本 {applied[-1]}。")
 
-        self.sqlDatabase = SQLDatabase.from_uri(f"sqlite:///{self.db_name}")
-
-    def _create_tables(self):
-        create_users_table = """
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_name TEXT NOT NULL UNIQUE
-        );
-        """
-
-        create_food_categories_table = """
-        CREATE TABLE IF NOT EXISTS food_categories (
-            category_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            category_name TEXT NOT NULL UNIQUE,
-            nutrition_value TEXT,
-            recommended_frequency TEXT
-        );
-        """
-
-        create_meals_table = """
-        CREATE TABLE IF NOT EXISTS meals (
-            meal_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            meal_date DATE DEFAULT CURRENT_DATE,
-            meal_type TEXT CHECK(meal_type IN ('breakfast', 'lunch', 'dinner', 'snack')) NOT NULL,
-            food_name TEXT NOT NULL,
-            category_id INTEGER,
-            description TEXT,
-            FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE,
-            FOREIGN KEY (category_id) REFERENCES food_categories (category_id) ON DELETE SET NULL
-        );
-        """
-
-        with self.conn as conn:
-            cursor = conn.cursor()
-            cursor.execute(create_users_table)
-            cursor.execute(create_food_categories_table)
-            cursor.execute(create_meals_table)
-            
-            default_categories = [
-                ('蔬菜类', '富含维生素、矿物质和膳食纤维，低热量', '每天至少摄入300-500克'),
-                ('水果类', '富含维生素C、抗氧化物和膳食纤维', '每天1-2份'),
-                ('谷物类', '提供碳水化合物和B族维生素，是能量的主要来源', '每天作为主食'),
-                ('肉蛋类', '富含优质蛋白质和铁', '每周3-5次，每次适量'),
-                ('奶制品', '富含钙质和蛋白质', '每天1-2份'),
-                ('豆制品', '提供植物蛋白和异黄酮', '每周3-4次'),
-                ('坚果类', '含有健康脂肪和多种矿物质', '每天一小把（约25克）'),
-                ('海鲜类', '富含优质蛋白质和ω-3脂肪酸', '每周2-3次')
-            ]
-            
-            cursor.executemany(
-                "INSERT OR IGNORE INTO food_categories (category_name, nutrition_value, recommended_frequency) VALUES (?, ?, ?)",
-                default_categories
-            )
-            
-            conn.commit()
-        print("数据库和表已创建，默认食物类别已添加。")
-        
+        self.sqlDatabase = self._create_sqlDatabase()
+        self.schemaCache = SchemaCache(self)
+        self.foodCategoryResolver = FoodCategoryResolver(self)
+        # 相同的写入在这段时间内只执行一次（防止重复点击发送导致重复记录），为0时关闭
+        self.write_idempotency_seconds = write_idempotency_seconds
+        # 大模型生成SQL的执行计划检查和每条语句的执行时间上限
+        self.query_guard = QueryGuard(max_seconds=query_seconds)
+        self.sqlValidator = SqlValidator(self, LLM_TABLES)
 
     def register_user(self, username):
         try:
-            cursor = self.conn.cursor()
-            cursor.execute("INSERT INTO users (user_name) VALUES (?)", (username,))
-            self.conn.commit()
+            with self.connections.write() as conn:
+                cursor = conn.execute("INSERT INTO users (user_name) VALUES (?)", (username,))
             return cursor.lastrowid
         except sqlite3.IntegrityError:
             return None
             
     def login_user(self, username):
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT user_id FROM users WHERE user_name = ?", (username,))
-        result = cursor.fetchone()
+        with self.connections.read() as conn:
+            result = conn.execute("SELECT user_id FROM users WHERE user_name = ?", (username,)).fetchone()
         return result[0] if result else None
         
     def get_user_by_name(self, username):
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT user_id, user_name FROM users WHERE user_name = ?", (username,))
-        result = cursor.fetchone()
+        with self.connections.read() as conn:
+            result = conn.execute("SELECT user_id, user_name FROM users WHERE user_name = ?", (username,)).fetchone()
         if result:
             return {"user_id": result[0], "user_name": result[1]}
         return None
 
     def add_food_category(self, category_name, nutrition_value=None, recommended_frequency=None):
         try:
-            cursor = self.conn.cursor()
-            cursor.execute(
-                "INSERT INTO food_categories (category_name, nutrition_value, recommended_frequency) VALUES (?, ?, ?)",
-                (category_name, nutrition_value, recommended_frequency)
-            )
-            self.conn.commit()
+            with self.connections.write() as conn:
+                cursor = conn.execute(
+                    "INSERT INTO food_categories (category_name, nutrition_value, recommended_frequency) VALUES (?, ?, ?)",
+                    (category_name, nutrition_value, recommended_frequency)
+                )
             return cursor.lastrowid
         except sqlite3.IntegrityError:
             return None
             
     def get_all_food_categories(self):
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT category_id, category_name, nutrition_value, recommended_frequency FROM food_categories")
-        results = cursor.fetchall()
+        with self.connections.read() as conn:
+            results = conn.execute(
+                "SELECT category_id, category_name, nutrition_value, recommended_frequency FROM food_categories"
+            ).fetchall()
         categories = []
         for row in results:
             categories.append({
@@ -123,64 +103,322 @@ class SQLiteDB:
             })
         return categories
         
+    def get_category_id(self, category_name):
+        with self.connections.read() as conn:
+            result = conn.execute(
+                "SELECT category_id FROM food_categories WHERE category_name = ?", (category_name,)
+            ).fetchone()
+        return result[0] if result else None
+
+    def resolve_food_category(self, food_name):
+        """
+        在本地解析食物名称对应的类别ID（见 FoodCategoryResolver），无法判断时返回None
+        """
+        return self.foodCategoryResolver.resolve(food_name)
+
     def add_meal(self, user_id, meal_type, food_name, category_id=None, description=None, meal_date=None):
-        cursor = self.conn.cursor()
-        if meal_date:
-            cursor.execute(
-                "INSERT INTO meals (user_id, meal_type, food_name, category_id, description, meal_date) VALUES (?, ?, ?, ?, ?, ?)",
-                (user_id, meal_type, food_name, category_id, description, meal_date)
-            )
-        else:
-            cursor.execute(
-                "INSERT INTO meals (user_id, meal_type, food_name, category_id, description) VALUES (?, ?, ?, ?, ?)",
-                (user_id, meal_type, food_name, category_id, description)
-            )
-        self.conn.commit()
+        with self.connections.write() as conn:
+            if meal_date:
+                cursor = conn.execute(
+                    "INSERT INTO meals (user_id, meal_type, food_name, category_id, description, meal_date) VALUES (?, ?, ?, ?, ?, ?)",
+                    (user_id, meal_type, food_name, category_id, description, meal_date)
+                )
+            else:
+                cursor = conn.execute(
+                    "INSERT INTO meals (user_id, meal_type, food_name, category_id, description) VALUES (?, ?, ?, ?, ?)",
+                    (user_id, meal_type, food_name, category_id, description)
+                )
         return cursor.lastrowid
         
-    def get_user_meals(self, user_id, start_date=None, end_date=None):
-        cursor = self.conn.cursor()
-        query = """
-        SELECT m.meal_id, m.meal_date, m.meal_type, m.food_name, m.description, 
-               c.category_id, c.category_name, c.nutrition_value, c.recommended_frequency
-        FROM meals m
-        LEFT JOIN food_categories c ON m.category_id = c.category_id
-        WHERE m.user_id = ?
+    def add_meals(self, meals, chunk_size=1000):
         """
+        批量添加饮食记录
+
+        参数:
+            meals (iterable): (user_id, meal_type, food_name, category_id, description, meal_date) 元组，
+                              可以是生成器；meal_date 为None时使用当前日期
+            chunk_size (int): 每个事务写入的行数，分块提交以控制事务大小和内存占用
+
+        返回:
+            int: 写入的行数
+        """
+        meals = iter(meals)
+        total = 0
+        while True:
+            chunk = list(islice(meals, chunk_size))
+            if not chunk:
+                break
+            with self.connections.write() as conn:
+                conn.executemany(
+                    "INSERT INTO meals (user_id, meal_type, food_name, category_id, description, meal_date) "
+                    "VALUES (?, ?, ?, ?, ?, COALESCE(?, CURRENT_DATE))",
+                    chunk
+                )
+            total += len(chunk)
+        return total
+
+    def record_meals(self, meals, category_guessed=False):
+        """
+        在一个事务中用一条多行INSERT写入一条消息里的多条饮食记录，全部成功或全部失败
+
+        参数:
+            meals (list): (user_id, meal_type, food_name, category_id, description, meal_date) 元组列表
+            category_guessed (bool): 类别是否由 resolve_food_category 在本地推断，推断的类别不会再被学习
+
+        返回:
+            list: 按输入顺序排列的 meal_id
+        """
+        if not meals:
+            return []
+        values = ", ".join(["(?, ?, ?, ?, ?, COALESCE(?, CURRENT_DATE), ?)"] * len(meals))
+        params = [value for meal in meals for value in (*meal, int(category_guessed))]
+        with self.connections.write() as conn:
+            # 幂等窗口内重复提交的同一组记录不再写入，直接返回第一次写入的 meal_id
+            write_key = self._write_key("record_meals", params)
+            previous = self._recent_write(conn, write_key)
+            if previous is not None:
+                return previous
+            rows = conn.execute(
+                "INSERT INTO meals (user_id, meal_type, food_name, category_id, description, meal_date, category_guessed) "
+                f"VALUES {values} RETURNING meal_id",
+                params
+            ).fetchall()
+            meal_ids = sorted(row[0] for row in rows)
+            self._remember_write(conn, write_key, meal_ids)
+        return meal_ids
+
+    def execute_write(self, statement, user_id=None):
+        """
+        执行一条写入语句（大模型生成的 INSERT/UPDATE/DELETE），返回受影响的行数
+
+        幂等窗口内重复执行的相同语句（如用户重复点击发送）不会再次写入，返回第一次的行数。
+        执行前经过 query_guard 的执行计划检查（只能写当前用户 user_id 的记录），
+        执行时间超过上限时回滚并抛出 QueryRejected
+        """
+        with self.connections.write() as conn:
+            write_key = self._write_key("execute_write", [" ".join(statement.split())])
+            previous = self._recent_write(conn, write_key)
+            if previous is not None:
+                return previous
+            self.query_guard.check_plan(conn, statement, user_id)
+            with self.query_guard.time_budget(conn):
+                rowcount = conn.execute(statement).rowcount
+            self._remember_write(conn, write_key, rowcount)
+        return rowcount
+
+    @staticmethod
+    def _write_key(operation, params):
+        raw = json.dumps([operation, params], ensure_ascii=False, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _recent_write(self, conn, write_key):
+        if not self.write_idempotency_seconds:
+            return None
+        row = conn.execute(
+            "SELECT result FROM recent_writes WHERE write_key = ? AND created_at >= ?",
+            (write_key, time.time() - self.write_idempotency_seconds)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _remember_write(self, conn, write_key, result):
+        if not self.write_idempotency_seconds:
+            return
+        now = time.time()
+        conn.execute("DELETE FROM recent_writes WHERE created_at < ?", (now - self.write_idempotency_seconds,))
+        conn.execute(
+            "INSERT OR REPLACE INTO recent_writes (write_key, result, created_at) VALUES (?, ?, ?)",
+            (write_key, json.dumps(result), now)
+        )
+
+    def get_user_ids(self):
+        with self.connections.read() as conn:
+            return dict(conn.execute("SELECT user_name, user_id FROM users"))
+
+    def get_category_ids(self):
+        with self.connections.read() as conn:
+            return dict(conn.execute("SELECT category_name, category_id FROM food_categories"))
+
+    def _fetch_meals_page(self, conn, user_id, start_date, end_date, page_size, cursor):
+        query = MEAL_COLUMNS_SQL + " WHERE m.user_id = ?"
+        params = [user_id]
+        if start_date:
+            query += " AND m.meal_date >= ?"
+            params.append(start_date)
+        if end_date:
+            query += " AND m.meal_date <= ?"
+            params.append(end_date)
+        if cursor is None:
+            query += " ORDER BY m.meal_date DESC, m.meal_id DESC LIMIT ?"
+            return [Meal(*row) for row in conn.execute(query, params + [page_size])]
+
+        # 键集分页：从上一页最后一条记录之后继续，不使用 OFFSET。
+        # 条件写成 meal_date <= ? 的范围形式，才能利用 (user_id, meal_date) 索引直接定位
+        last_date, last_id = cursor
+        page = []
+        if last_date is not None:
+            page = [Meal(*row) for row in conn.execute(
+                query + " AND m.meal_date <= ? AND (m.meal_date < ? OR m.meal_id < ?)"
+                        " ORDER BY m.meal_date DESC, m.meal_id DESC LIMIT ?",
+                params + [last_date, last_date, last_id, page_size]
+            )]
+            last_id = None
+        # 倒序时没有日期的记录排在最后
+        if len(page) < page_size and not start_date and not end_date:
+            null_query = query + " AND m.meal_date IS NULL"
+            null_params = list(params)
+            if last_id is not None:
+                null_query += " AND m.meal_id < ?"
+                null_params.append(last_id)
+            page += [Meal(*row) for row in conn.execute(
+                null_query + " ORDER BY m.meal_id DESC LIMIT ?", null_params + [page_size - len(page)]
+            )]
+        return page
+
+    def iter_user_meals(self, user_id, start_date=None, end_date=None, page_size=500):
+        """
+        按日期从新到旧逐条返回用户的饮食记录
+
+        参数:
+            user_id (int): 用户ID
+            start_date (str, 可选): 开始日期（包含）
+            end_date (str, 可选): 结束日期（包含）
+            page_size (int): 每次从数据库读取的行数
+
+        返回:
+            generator: Meal 命名元组
+
+        功能:
+            按 (meal_date, meal_id) 键集分页读取，每次只在内存中保留一页，
+            记录再多也不会一次性加载全部历史
+        """
+        cursor = None
+        while True:
+            with self.connections.read() as conn:
+                page = self._fetch_meals_page(conn, user_id, start_date, end_date, page_size, cursor)
+            yield from page
+            if len(page) < page_size:
+                return
+            cursor = (page[-1].meal_date, page[-1].meal_id)
+
+    def get_user_meals_page(self, user_id, start_date=None, end_date=None, page_size=50, cursor=None):
+        """
+        分页获取用户的饮食记录，用于界面展示和报告
+
+        参数:
+            cursor (tuple, 可选): 上一页返回的游标，为None时从最新的记录开始
+
+        返回:
+            tuple: (Meal 列表, 下一页的游标)，没有更多记录时游标为None
+        """
+        with self.connections.read() as conn:
+            # 多取一条用于判断是否还有下一页
+            page = self._fetch_meals_page(conn, user_id, start_date, end_date, page_size + 1, cursor)
+        if len(page) <= page_size:
+            return page, None
+        page = page[:page_size]
+        return page, (page[-1].meal_date, page[-1].meal_id)
+
+    def get_user_meals(self, user_id, start_date=None, end_date=None):
+        # 保持原来的排序（同一天内按 meal_type），分页接口才按 meal_id 排序
+        query = MEAL_COLUMNS_SQL + " WHERE m.user_id = ?"
         params = [user_id]
-        
         if start_date:
             query += " AND m.meal_date >= ?"
             params.append(start_date)
         if end_date:
             query += " AND m.meal_date <= ?"
             params.append(end_date)
-            
         query += " ORDER BY m.meal_date DESC, m.meal_type"
-        
-        cursor.execute(query, params)
-        results = cursor.fetchall()
-        
-        meals = []
-        for row in results:
-            meals.append({
-                "meal_id": row[0],
-                "meal_date": row[1],
-                "meal_type": row[2],
-                "food_name": row[3],
-                "description": row[4],
-                "category_id": row[5],
-                "category_name": row[6],
-                "nutrition_value": row[7],
-                "recommended_frequency": row[8]
-            })
-        return meals
+        with self.connections.read() as conn:
+            return [Meal(*row)._asdict() for row in conn.execute(query, params)]
+
+    def get_category_summary(self, user_id, start_date, end_date):
+        """
+        统计用户在日期范围内每个食物类别的用餐次数
+
+        参数:
+            user_id (int): 用户ID
+            start_date (str|date): 开始日期（包含）
+            end_date (str|date): 结束日期（包含），早于开始日期时两者交换
+
+        返回:
+            list: 每个类别一项，包含 category_name、recommended_frequency、meal_count，
+                  没有吃过的类别 meal_count 为0，有未分类的记录时额外返回 category_name=None 的一项
+
+        功能:
+            读取由触发器维护的 meal_category_daily / meal_category_weekly 汇总表，
+            范围内完整的周使用周汇总，两端不足一周的部分使用日汇总，不扫描 meals 表
+        """
+        start = date.fromisoformat(str(start_date)[:10])
+        end = date.fromisoformat(str(end_date)[:10])
+        if start > end:
+            start, end = end, start
+        # 范围内第一个完整周和最后一个完整周的周一
+        first_monday = start + timedelta(days=(7 - start.weekday()) % 7)
+        last_monday = end - timedelta(days=end.weekday()) - (timedelta(days=7) if end.weekday() != 6 else timedelta(0))
+
+        parts = []
+        params = []
+        day_ranges = [(start, end)]
+        if first_monday <= last_monday:
+            parts.append("SELECT category_id, meal_count FROM meal_category_weekly "
+                         "WHERE user_id = ? AND week_start >= ? AND week_start <= ?")
+            params += [user_id, first_monday.isoformat(), last_monday.isoformat()]
+            day_ranges = [(start, first_monday - timedelta(days=1)), (last_monday + timedelta(days=7), end)]
+        for range_start, range_end in day_ranges:
+            if range_start <= range_end:
+                parts.append("SELECT category_id, meal_count FROM meal_category_daily "
+                             "WHERE user_id = ? AND meal_date >= ? AND meal_date <= ?")
+                params += [user_id, range_start.isoformat(), range_end.isoformat()]
+
+        query = f"""
+        WITH rollup AS ({" UNION ALL ".join(parts)})
+        SELECT c.category_name, c.recommended_frequency, COALESCE(SUM(r.meal_count), 0)
+        FROM food_categories c
+        LEFT JOIN rollup r ON r.category_id = c.category_id
+        GROUP BY c.category_id
+        UNION ALL
+        SELECT NULL, NULL, SUM(meal_count) FROM rollup
+        WHERE category_id NOT IN (SELECT category_id FROM food_categories)
+        HAVING SUM(meal_count) > 0
+        """
+        with self.connections.read() as conn:
+            results = conn.execute(query, params).fetchall()
+
+        return [
+            {"category_name": row[0], "recommended_frequency": row[1], "meal_count": row[2]}
+            for row in results
+        ]
+
+    def get_data_version(self, user_id):
+        with self.connections.read() as conn:
+            result = conn.execute("SELECT version FROM user_data_versions WHERE user_id = ?", (user_id,)).fetchone()
+        return result[0] if result else 0
+
+    def _create_sqlDatabase(self):
+        return SQLDatabase.from_uri(
+            f"sqlite:///{self.db_name}",
+            engine_args={"connect_args": {"timeout": self.connections.busy_timeout_ms / 1000}},
+            include_tables=LLM_TABLES
+        )
 
     def get_sqlDatabase(self):
         return self.sqlDatabase
+
+    def reload_sqlDatabase(self):
+        self.sqlDatabase = self._create_sqlDatabase()
+        return self.sqlDatabase
+
+    def get_schema_snapshot(self):
+        return self.schemaCache.get()
+
+    def validate_sql(self, statement):
+        """在本地检查SQL（不执行），返回错误原因，没有问题时返回None"""
+        return self.sqlValidator.validate(statement)
         
     def close(self):
-        self.conn.close()
+        self.connections.close()
+        self.sqlDatabase._engine.dispose()
         print("数据库连接已关闭。")
 
 if __name__ == "__main__":
@@ -0,0 +1,52 @@
+import threading
+
+
+class SchemaCache:
+    """
+    数据库表结构快照
+
+    表结构只在建表（或后续的DDL）时才会改变，而工作流每条消息都要把表名列表和
+    表结构交给 query_gen。这里把 sql_db_list_tables / sql_db_schema 两个工具
+    的输出计算一次并缓存，之后只通过 PRAGMA schema_version 判断是否发生过DDL，
+    发生变化时才重新反射表结构。
+    """
+
+    def __init__(self, sqLite):
+        self.sqLite = sqLite
+        self._lock = threading.Lock()
+        self._schema_version = None
+        self._list_tables = None
+        self._table_info = None
+
+    def _current_version(self):
+        with self.sqLite.connections.read() as conn:
+            return conn.execute("PRAGMA schema_version").fetchone()[0]
+
+    def _refresh(self, version):
+        # 已经构建过快照说明是DDL导致的失效，需要重新反射SQLAlchemy的元数据
+        if self._list_tables is not None:
+            self.sqLite.reload_sqlDatabase()
+        sql_database = self.sqLite.get_sqlDatabase()
+        table_names = list(sql_database.get_usable_table_names())
+        # 与 sql_db_list_tables / sql_db_schema 工具的输出格式保持一致
+        self._list_tables = ", ".join(table_names)
+        self._table_info = sql_database.get_table_info_no_throw(table_names)
+        self._schema_version = version
+
+    def get(self):
+        """
+        获取表结构快照
+
+        返回:
+            tuple: (表名列表字符串, 表结构字符串)
+        """
+        version = self._current_version()
+        with self._lock:
+            if version != self._schema_version:
+                self._refresh(version)
+            return self._list_tables, self._table_info
+
+    def invalidate(self):
+        """强制下一次 get() 重新计算快照"""
+        with self._lock:
+            self._schema_version = None
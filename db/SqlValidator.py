@@ -0,0 +1,149 @@
+import re
+import sqlite3
+import threading
+
+CHECK_IN_PATTERN = re.compile(r"CHECK\s*\(\s*(\w+)\s+IN\s*\(([^)]*)\)\s*\)", re.I)
+LITERAL_PATTERN = re.compile(r"'((?:[^']|'')*)'")
+NO_SUCH_TABLE_PATTERN = re.compile(r"no such table: (\S+)")
+NO_SUCH_COLUMN_PATTERN = re.compile(r"no such column: (\S+)")
+
+
+def split_top_level(text, separator=","):
+    """按顶层（不在括号和引号内）的分隔符切分"""
+    parts, depth, quote, start = [], 0, None, 0
+    for index, char in enumerate(text):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in "'\"":
+            quote = char
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == separator and depth == 0:
+            parts.append(text[start:index].strip())
+            start = index + 1
+    parts.append(text[start:].strip())
+    return parts
+
+
+def value_tuples(text):
+    """返回 VALUES 后面各个顶层括号中的内容"""
+    groups, depth, quote, start = [], 0, None, 0
+    for index, char in enumerate(text):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in "'\"":
+            quote = char
+        elif char == "(":
+            if depth == 0:
+                start = index + 1
+            depth += 1
+        elif char == ")":
+            depth -= 1
+            if depth == 0:
+                groups.append(text[start:index])
+        elif char == ";" and depth == 0:
+            break
+    return groups
+
+
+class SqlValidator:
+    """
+    在本地检查大模型生成的SQL
+
+    在只读连接上 EXPLAIN 语句（只编译不执行），表名、列名和语法错误在这一步暴露，
+    并在错误信息后附上可用的表或列；再检查写入和比较中使用的字面值是否满足表上的
+    CHECK(col IN (...)) 约束（如 meals.meal_type）。通过检查的语句才交给 db_query_tool 执行，
+    不需要再让大模型检查一遍。表结构只在 PRAGMA schema_version 变化时重新读取。
+    """
+
+    def __init__(self, sqLite, tables):
+        self.sqLite = sqLite
+        # 错误提示中列出的表（暴露给大模型的业务表）
+        self.tables = list(tables)
+        self._lock = threading.Lock()
+        self._schema_version = None
+        self._columns = {}   # 表名 -> 列名列表
+        self._allowed = {}   # (表名, 列名) -> 允许的取值
+
+    def _refresh(self, conn):
+        version = conn.execute("PRAGMA schema_version").fetchone()[0]
+        with self._lock:
+            if version == self._schema_version:
+                return
+            columns, allowed = {}, {}
+            for name, sql in conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'table'"):
+                columns[name] = [row[1] for row in conn.execute(f'PRAGMA table_info("{name}")')]
+                for column, values in CHECK_IN_PATTERN.findall(sql or ""):
+                    allowed[(name, column)] = LITERAL_PATTERN.findall(values)
+            self._columns, self._allowed, self._schema_version = columns, allowed, version
+
+    def _describe_tables(self):
+        return "；".join(f"{table}({', '.join(self._columns.get(table, []))})" for table in self.tables)
+
+    def _explain(self, conn, statement):
+        try:
+            conn.execute(f"EXPLAIN {statement}").close()
+        except sqlite3.ProgrammingError as e:
+            if "one statement" in str(e):
+                return "一次只能执行一条SQL语句，多条语句请分别调用工具"
+            raise
+        except sqlite3.Error as e:
+            message = str(e)
+            if NO_SUCH_TABLE_PATTERN.search(message):
+                return f"{message}。可用的表：{', '.join(self.tables)}"
+            if NO_SUCH_COLUMN_PATTERN.search(message):
+                return f"{message}。各表的列：{self._describe_tables()}"
+            return f"SQL 无法编译：{message}"
+        return None
+
+    def _literal_values(self, statement, table, column):
+        """语句中 column 被赋予或比较的字面值"""
+        values = []
+        name = rf"\b(?:\w+\.)?{re.escape(column)}"
+        for match in re.finditer(rf"{name}\s*(?:=|==|!=|<>)\s*'((?:[^']|'')*)'", statement, re.I):
+            values.append(match.group(1))
+        for match in re.finditer(rf"{name}\s+(?:NOT\s+)?IN\s*\(([^)]*)\)", statement, re.I):
+            values.extend(LITERAL_PATTERN.findall(match.group(1)))
+        insert = re.search(
+            rf"INSERT\s+(?:OR\s+\w+\s+)?INTO\s+[\"`]?{re.escape(table)}[\"`]?\s*\(([^)]*)\)\s*VALUES\s*(.*)",
+            statement, re.I | re.S
+        )
+        if insert:
+            columns = [c.strip().strip('"`').lower() for c in insert.group(1).split(",")]
+            if column.lower() in columns:
+                index = columns.index(column.lower())
+                for group in value_tuples(insert.group(2)):
+                    items = split_top_level(group)
+                    literal = LITERAL_PATTERN.fullmatch(items[index]) if index < len(items) else None
+                    if literal:
+                        values.append(literal.group(1))
+        return values
+
+    def _check_values(self, statement):
+        for (table, column), allowed in self._allowed.items():
+            if not re.search(rf"\b{re.escape(column)}\b", statement, re.I):
+                continue
+            for value in self._literal_values(statement, table, column):
+                if value not in allowed:
+                    return (f"{table}.{column} 的值 '{value}' 无效，只能是以下值之一："
+                            f"{', '.join(repr(v) for v in allowed)}")
+        return None
+
+    def validate(self, statement):
+        """
+        参数:
+            statement (str): 待执行的SQL语句
+
+        返回:
+            str或None: 具体的错误原因，检查通过时为None
+        """
+        if not statement or not statement.strip():
+            return "SQL 语句为空"
+        with self.sqLite.connections.read() as conn:
+            self._refresh(conn)
+            error = self._explain(conn, statement)
+        return error or self._check_values(statement)
@@ -0,0 +1,163 @@
+"""
+从JSONL/CSV文件批量导入历史饮食记录
+
+用法:
+    python -m db.import_meals meals.jsonl
+    python -m db.import_meals meals.csv --create-users --chunk-size 5000
+
+每行需要包含 user_name（或 user_id）、meal_type、food_name，可选 category_name（或 category_id）、
+description、meal_date。文件通过生成器逐行读取、分块写入，内存占用与文件大小无关。
+"""
+import argparse
+import csv
+import json
+import os
+import time
+from datetime import date
+
+from db.SQLiteDB import SQLiteDB
+
+MEAL_TYPES = {
+    "breakfast": "breakfast", "早餐": "breakfast",
+    "lunch": "lunch", "午餐": "lunch",
+    "dinner": "dinner", "晚餐": "dinner",
+    "snack": "snack", "加餐": "snack",
+}
+
+
+def read_rows(path, file_format=None):
+    """逐行读取JSONL或CSV文件，返回字典生成器，无法解析的JSON行返回None"""
+    file_format = file_format or ("csv" if path.lower().endswith(".csv") else "jsonl")
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if file_format == "csv":
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    yield None
+
+
+class MealImporter:
+    def __init__(self, sqLite, create_users=False, report_every=100000):
+        self.sqLite = sqLite
+        self.create_users = create_users
+        self.report_every = report_every
+        # 名称 -> ID 的内存映射，导入过程中不再逐行查询数据库
+        self.user_ids = sqLite.get_user_ids()
+        self.category_ids = sqLite.get_category_ids()
+        # 直接给出ID的行只接受已存在的ID，避免外键约束失败中断整个分块
+        self.known_user_ids = set(self.user_ids.values())
+        self.known_category_ids = set(self.category_ids.values())
+        self.imported = 0
+        self.skipped = 0
+        self.started = None
+
+    def _user_id(self, row):
+        """
+        异常:
+            ValueError: user_id 不是整数或不存在
+        """
+        if row.get("user_id"):
+            user_id = int(row["user_id"])
+            if user_id not in self.known_user_ids:
+                raise ValueError(f"用户 {user_id} 不存在")
+            return user_id
+        user_name = row.get("user_name")
+        if not user_name:
+            return None
+        user_id = self.user_ids.get(user_name)
+        if user_id is None and self.create_users:
+            user_id = self.sqLite.register_user(user_name)
+            self.user_ids[user_name] = user_id
+            self.known_user_ids.add(user_id)
+        return user_id
+
+    def _category_id(self, row):
+        """
+        异常:
+            ValueError: category_id 不是整数或不存在
+        """
+        if row.get("category_id"):
+            category_id = int(row["category_id"])
+            if category_id not in self.known_category_ids:
+                raise ValueError(f"类别 {category_id} 不存在")
+            return category_id
+        return self.category_ids.get(row.get("category_name"))
+
+    @staticmethod
+    def _meal_date(row):
+        """
+        返回:
+            str或None: YYYY-MM-DD 格式的日期，没有日期时为None（写入时使用当前日期）
+
+        异常:
+            ValueError: 日期格式不正确
+        """
+        meal_date = str(row.get("meal_date") or "").strip()
+        return date.fromisoformat(meal_date[:10]).isoformat() if meal_date else None
+
+    def _to_meal(self, row):
+        """返回 add_meals 需要的元组，缺少必要字段时返回None"""
+        if not isinstance(row, dict):
+            return None
+        user_id = self._user_id(row)
+        meal_type = MEAL_TYPES.get(str(row.get("meal_type") or "").strip().lower())
+        food_name = str(row.get("food_name") or "").strip()
+        if user_id is None or meal_type is None or not food_name:
+            return None
+        return (user_id, meal_type, food_name, self._category_id(row),
+                row.get("description") or None, self._meal_date(row))
+
+    def to_meals(self, rows):
+        """把原始行转换为 add_meals 需要的元组，无法解析的行计入 skipped"""
+        for row in rows:
+            try:
+                meal = self._to_meal(row)
+            except (TypeError, ValueError):
+                meal = None
+            if meal is None:
+                self.skipped += 1
+                continue
+            self.imported += 1
+            if self.imported % self.report_every == 0:
+                self.report()
+            yield meal
+
+    def rate(self):
+        elapsed = time.perf_counter() - self.started
+        return self.imported / elapsed if elapsed > 0 else 0.0
+
+    def report(self):
+        print(f"已导入 {self.imported} 行，跳过 {self.skipped} 行，{self.rate():.0f} 行/秒")
+
+    def run(self, rows, chunk_size=1000):
+        self.started = time.perf_counter()
+        self.sqLite.add_meals(self.to_meals(rows), chunk_size=chunk_size)
+        self.report()
+        return self.imported, self.skipped
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="批量导入历史饮食记录")
+    parser.add_argument("path", help="JSONL或CSV文件路径")
+    parser.add_argument("--format", choices=["jsonl", "csv"], help="文件格式，默认按扩展名判断")
+    parser.add_argument("--db", default="healthMealAssistant.db", help="db/ 目录下的数据库文件名")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="每个事务写入的行数")
+    parser.add_argument("--create-users", action="store_true", help="自动注册不存在的用户")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        raise FileNotFoundError(f"文件 {args.path} 不存在")
+
+    sqLite = SQLiteDB(args.db)
+    try:
+        MealImporter(sqLite, create_users=args.create_users).run(
+            read_rows(args.path, args.format), chunk_size=args.chunk_size
+        )
+    finally:
+        sqLite.close()
@@ -0,0 +1,211 @@
+"""
+数据库版本迁移
+
+每个迁移有一个递增的版本号，当前版本记录在 PRAGMA user_version 中。
+SQLiteDB 初始化时调用 migrate()，依次执行所有高于当前版本的迁移，
+每个迁移和版本号的更新在同一个事务中完成，失败时整体回滚。
+新的表结构变更只需要在 MIGRATIONS 末尾追加一项。
+"""
+
+
+def _create_base_tables(cursor):
+    create_users_table = """
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_name TEXT NOT NULL UNIQUE
+    );
+    """
+
+    create_food_categories_table = """
+    CREATE TABLE IF NOT EXISTS food_categories (
+        category_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        category_name TEXT NOT NULL UNIQUE,
+        nutrition_value TEXT,
+        recommended_frequency TEXT
+    );
+    """
+
+    create_meals_table = """
+    CREATE TABLE IF NOT EXISTS meals (
+        meal_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        meal_date DATE DEFAULT CURRENT_DATE,
+        meal_type TEXT CHECK(meal_type IN ('breakfast', 'lunch', 'dinner', 'snack')) NOT NULL,
+        food_name TEXT NOT NULL,
+        category_id INTEGER,
+        description TEXT,
+        FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE,
+        FOREIGN KEY (category_id) REFERENCES food_categories (category_id) ON DELETE SET NULL
+    );
+    """
+
+    cursor.execute(create_users_table)
+    cursor.execute(create_food_categories_table)
+    cursor.execute(create_meals_table)
+
+    default_categories = [
+        ('蔬菜类', '富含维生素、矿物质和膳食纤维，低热量', '每天至少摄入300-500克'),
+        ('水果类', '富含维生素C、抗氧化物和膳食纤维', '每天1-2份'),
+        ('谷物类', '提供碳水化合物和B族维生素，是能量的主要来源', '每天作为主食'),
+        ('肉蛋类', '富含优质蛋白质和铁', '每周3-5次，每次适量'),
+        ('奶制品', '富含钙质和蛋白质', '每天1-2份'),
+        ('豆制品', '提供植物蛋白和异黄酮', '每周3-4次'),
+        ('坚果类', '含有健康脂肪和多种矿物质', '每天一小把（约25克）'),
+        ('海鲜类', '富含优质蛋白质和ω-3脂肪酸', '每周2-3次')
+    ]
+
+    cursor.executemany(
+        "INSERT OR IGNORE INTO food_categories (category_name, nutrition_value, recommended_frequency) VALUES (?, ?, ?)",
+        default_categories
+    )
+
+
+def _create_data_version_tracking(cursor):
+    # 每个用户一个数据版本号，meals 表的任何写入（包括大模型生成的SQL）都会通过触发器递增
+    create_versions_table = """
+    CREATE TABLE IF NOT EXISTS user_data_versions (
+        user_id INTEGER PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    );
+    """
+    bump_version = """
+        INSERT INTO user_data_versions (user_id, version) VALUES ({row}.user_id, 1)
+        ON CONFLICT(user_id) DO UPDATE SET version = version + 1;
+    """
+    create_triggers = [
+        f"CREATE TRIGGER IF NOT EXISTS meals_version_insert AFTER INSERT ON meals BEGIN {bump_version.format(row='NEW')} END;",
+        f"CREATE TRIGGER IF NOT EXISTS meals_version_delete AFTER DELETE ON meals BEGIN {bump_version.format(row='OLD')} END;",
+        f"CREATE TRIGGER IF NOT EXISTS meals_version_update AFTER UPDATE ON meals BEGIN "
+        f"{bump_version.format(row='OLD')} {bump_version.format(row='NEW')} END;",
+    ]
+    cursor.execute(create_versions_table)
+    for create_trigger in create_triggers:
+        cursor.execute(create_trigger)
+
+
+def _create_meal_indexes(cursor):
+    # 所有饮食查询都按 user_id 过滤并按 meal_date 范围筛选/排序，类别关联通过 category_id
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_meals_user_date ON meals (user_id, meal_date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_meals_category ON meals (category_id)")
+    cursor.execute("ANALYZE")
+
+
+def _create_category_rollups(cursor):
+    # 按用户、日期/周、类别预先汇总的用餐次数，由 meals 表上的触发器增量维护，
+    # 建议和报告类请求只需要读取少量汇总行，不必扫描全部饮食记录。
+    # category_id 为0表示未分类；week_start 是该周的周一
+    create_tables = [
+        """
+        CREATE TABLE IF NOT EXISTS meal_category_daily (
+            user_id INTEGER NOT NULL,
+            meal_date DATE NOT NULL,
+            category_id INTEGER NOT NULL,
+            meal_count INTEGER NOT NULL,
+            PRIMARY KEY (user_id, meal_date, category_id)
+        ) WITHOUT ROWID;
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS meal_category_weekly (
+            user_id INTEGER NOT NULL,
+            week_start DATE NOT NULL,
+            category_id INTEGER NOT NULL,
+            meal_count INTEGER NOT NULL,
+            PRIMARY KEY (user_id, week_start, category_id)
+        ) WITHOUT ROWID;
+        """,
+    ]
+    rollups = [
+        ("meal_category_daily", "meal_date", "date({row}.meal_date)"),
+        ("meal_category_weekly", "week_start", "date({row}.meal_date, 'weekday 0', '-6 days')"),
+    ]
+    adjust = """
+        INSERT INTO {table} (user_id, {period}, category_id, meal_count)
+        SELECT {row}.user_id, {key}, COALESCE({row}.category_id, 0), {delta}
+        WHERE {key} IS NOT NULL
+        ON CONFLICT(user_id, {period}, category_id) DO UPDATE SET meal_count = meal_count + excluded.meal_count;
+    """
+    cleanup = "DELETE FROM {table} WHERE meal_count <= 0;"
+
+    def statements(row, delta):
+        return " ".join(
+            adjust.format(table=table, period=period, key=key.format(row=row), row=row, delta=delta)
+            for table, period, key in rollups
+        )
+
+    cleanups = " ".join(cleanup.format(table=table) for table, _, _ in rollups)
+    create_triggers = [
+        f"CREATE TRIGGER IF NOT EXISTS meals_rollup_insert AFTER INSERT ON meals BEGIN {statements('NEW', 1)} END;",
+        f"CREATE TRIGGER IF NOT EXISTS meals_rollup_delete AFTER DELETE ON meals BEGIN "
+        f"{statements('OLD', -1)} {cleanups} END;",
+        f"CREATE TRIGGER IF NOT EXISTS meals_rollup_update AFTER UPDATE OF user_id, meal_date, category_id ON meals "
+        f"BEGIN {statements('OLD', -1)} {statements('NEW', 1)} {cleanups} END;",
+    ]
+    for create_table in create_tables:
+        cursor.execute(create_table)
+    # 已有的饮食记录一次性汇总
+    for table, period, key in rollups:
+        key = key.format(row="meals")
+        cursor.execute(f"DELETE FROM {table}")
+        cursor.execute(
+            f"INSERT INTO {table} (user_id, {period}, category_id, meal_count) "
+            f"SELECT user_id, {key}, COALESCE(category_id, 0), COUNT(*) FROM meals "
+            f"WHERE {key} IS NOT NULL GROUP BY user_id, {key}, COALESCE(category_id, 0)"
+        )
+    for create_trigger in create_triggers:
+        cursor.execute(create_trigger)
+
+
+def _create_recent_writes(cursor):
+    # 最近执行过的写操作（写入键 -> 结果），用于在幂等窗口内识别重复提交的同一次写入
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS recent_writes (
+        write_key TEXT PRIMARY KEY,
+        result TEXT NOT NULL,
+        created_at REAL NOT NULL
+    );
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_recent_writes_created_at ON recent_writes (created_at)")
+
+
+def _add_category_guessed(cursor):
+    # 1 表示类别是 FoodCategoryResolver 在本地推断的（模板直接写入），这些记录不再用于学习食物类别，
+    # 只有大模型写入、批量导入等给出了类别的记录才会被学到
+    cursor.execute("ALTER TABLE meals ADD COLUMN category_guessed INTEGER NOT NULL DEFAULT 0")
+
+
+# (版本号, 说明, 迁移函数)，版本号必须连续递增
+MIGRATIONS = [
+    (1, "创建基础表和默认食物类别", _create_base_tables),
+    (2, "用户数据版本号及触发器", _create_data_version_tracking),
+    (3, "meals 表按用户和日期的索引", _create_meal_indexes),
+    (4, "按日/周的类别用餐次数汇总表及触发器", _create_category_rollups),
+    (5, "写操作幂等记录表", _create_recent_writes),
+    (6, "meals 表标记本地推断的类别", _add_category_guessed),
+]
+
+
+def current_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(connections):
+    """
+    把数据库升级到最新版本
+
+    参数:
+        connections (ConnectionManager): 数据库连接管理器
+
+    返回:
+        list: 本次执行的迁移版本号
+    """
+    applied = []
+    with connections.write() as conn:
+        version = current_version(conn)
+        for migration_version, description, upgrade in MIGRATIONS:
+            if migration_version <= version:
+                continue
+            cursor = conn.cursor()
+            upgrade(cursor)
+            cursor.execute(f"PRAGMA user_version = {int(migration_version)}")
+            applied.append(migration_version)
+    return applied
@@ -1,9 +1,45 @@
+import atexit
 import json
 import os
 import sys
+import threading
 
 from loguru import logger
 
+LOG_FORMAT = '{time:YYYY-MM-DD HH:mm:ss.sss} | {level} | {message}'
+
+# 所有Logger共享的处理器：日志文件路径 -> loguru处理器ID
+_file_sinks = {}
+_sink_lock = threading.Lock()
+_console_sink = None
+
+
+def _setup_console_sink():
+    """
+    移除loguru默认的stderr处理器，并添加唯一的控制台处理器（只输出 to_screen=True 的日志）
+    """
+    global _console_sink
+    with _sink_lock:
+        if _console_sink is not None:
+            return
+        try:
+            logger.remove(0)
+        except ValueError:
+            pass
+        _console_sink = logger.add(
+            sys.stdout,
+            level='DEBUG',
+            enqueue=True,
+            filter=lambda record: record["extra"].get("to_screen", False),
+            format=LOG_FORMAT
+        )
+
+
+@atexit.register
+def _flush_sinks():
+    # 退出前等待后台队列中的日志全部写完
+    logger.complete()
+
 
 def loadLogConfig(config_file='log/log_config.json'):
     """
@@ -60,6 +96,48 @@ class Logger:
         self.compression = self.config.get('compression', 'zip')  
         # 日志文件名
         self.outputFileName = outputFileName  
+        # 控制台处理器全局只创建一次
+        _setup_console_sink()
+
+    def _get_sink(self, level: str) -> str:
+        """
+        获取（必要时创建）当前用户指定级别的文件日志处理器
+
+        参数:
+            level (str): 日志级别（INFO/DEBUG/ERROR）
+
+        返回:
+            str: 日志文件路径，同时作为日志记录绑定的路由键
+
+        功能:
+            1. 每个 (用户, 级别, 文件名) 只创建一次处理器，之后直接复用
+            2. 处理器通过 enqueue=True 在后台线程写文件，调用方不会阻塞在磁盘IO上
+            3. 通过 filter 只接收绑定了相同路由键的日志，多个Logger之间互不干扰
+        """
+        # 路径格式：log_dir/username/LEVEL/outputFileName.log
+        logFile = os.path.join(self.logDir + f"/{self.user_name}/{level}", f"{self.outputFileName}.log")
+        if logFile in _file_sinks:
+            return logFile
+        with _sink_lock:
+            if logFile not in _file_sinks:
+                os.makedirs(os.path.dirname(logFile), exist_ok=True)
+                _file_sinks[logFile] = logger.add(
+                    logFile,           # 日志文件路径
+                    level=level,       # 日志级别
+                    rotation=self.rotation,  # 轮转条件（文件大小）
+                    compression=self.compression,  # 压缩格式
+                    retention=self.retention,     # 保留时间
+                    encoding="utf-8",            # 文件编码
+                    enqueue=True,                # 通过后台队列写入
+                    filter=lambda record, key=logFile: record["extra"].get("log_file") == key,
+                    format=LOG_FORMAT
+                )
+        return logFile
+
+    def _log(self, level: str, printStr: str, printOnScreen: bool):
+        logFile = self._get_sink(level)
+        # 记录日志信息（换行符保证每条日志独立一行）
+        logger.bind(log_file=logFile, to_screen=printOnScreen).log(level, f"{printStr}\n")
 
     def info(self, printStr: str, printOnScreen: bool = True):
         """
@@ -70,45 +148,10 @@ class Logger:
             printOnScreen (bool): 是否同时在控制台显示日志，默认为True
             
         功能:
-            1. 在用户专属的INFO目录下创建日志文件
-            2. 配置日志记录器的输出格式和文件管理策略
-            3. 根据需要同时输出到文件和控制台
+            1. 写入用户专属的INFO目录下的日志文件
+            2. 根据需要同时输出到控制台
         """
-        # 创建用户专属的INFO日志目录
-        # 路径格式：log_dir/username/INFO
-        dirPath = self.logDir + f"/{self.user_name}/INFO"
-        # 如果目录不存在则创建
-        if not os.path.exists(dirPath):
-            os.makedirs(dirPath)
-        
-        # 拼接完整的日志文件路径
-        logFile = os.path.join(dirPath, f"{self.outputFileName}.log")
-        
-        # 移除之前的日志处理器（避免重复记录）
-        logger.remove()
-        
-        # 添加文件日志处理器
-        logger.add(
-            logFile,           # 日志文件路径
-            level='INFO',      # 日志级别
-            rotation=self.rotation,  # 轮转条件（文件大小）
-            compression=self.compression,  # 压缩格式
-            retention=self.retention,     # 保留时间
-            encoding="utf-8",            # 文件编码
-            # 日志格式：时间 | 级别 | 消息内容
-            format='{time:YYYY-MM-DD HH:mm:ss.sss} | {level} | {message}'
-        )
-        
-        # 如果需要同时输出到控制台
-        if printOnScreen:
-            logger.add(
-                sys.stdout,      # 输出到标准输出
-                level='INFO',
-                format='{time:YYYY-MM-DD HH:mm:ss.sss} | {level} | {message}'
-            )
-        
-        # 记录日志信息（换行符保证每条日志独立一行）
-        logger.info(f"{printStr}\n")
+        self._log('INFO', printStr, printOnScreen)
 
     def debug(self, printStr: str):
         """
@@ -118,30 +161,10 @@ class Logger:
             printStr (str): 需要记录的日志信息
             
         功能:
-            1. 在用户专属的DEBUG目录下创建日志文件
-            2. 配置DEBUG级别日志的文件管理策略
-            3. 同时输出到文件和控制台
+            1. 写入用户专属的DEBUG目录下的日志文件
+            2. 同时输出到控制台
         """
-        # 创建用户专属的DEBUG日志目录
-        dirPath = self.logDir + f"/{self.user_name}/DEBUG"
-        if not os.path.exists(dirPath):
-            os.makedirs(dirPath)
-        # 日志文件路径
-        logFile = os.path.join(dirPath, f"{self.outputFileName}.log")
-        # 移除旧处理器
-        logger.remove()
-        # 添加文件处理器
-        logger.add(logFile,
-                   level='DEBUG',
-                   rotation=self.rotation,  # 轮转大小条件
-                   compression=self.compression,  # 日志文件压缩格式
-                   retention=self.retention,
-                   encoding="utf-8",
-                   format='{time:YYYY-MM-DD HH:mm:ss.sss} | {level} | {message}')
-        # 添加控制台输出
-        logger.add(sys.stdout, level='DEBUG', format='{time:YYYY-MM-DD HH:mm:ss.sss} | {level} | {message}')
-        # 记录日志
-        logger.debug(f"{printStr}\n")
+        self._log('DEBUG', printStr, True)
 
     def error(self, printStr: str):
         """
@@ -151,27 +174,7 @@ class Logger:
             printStr (str): 需要记录的日志信息
             
         功能:
-            1. 在用户专属的ERROR目录下创建日志文件
-            2. 配置ERROR级别日志的文件管理策略
-            3. 同时输出到文件和控制台
+            1. 写入用户专属的ERROR目录下的日志文件
+            2. 同时输出到控制台
         """
-        # 创建用户专属的ERROR日志目录
-        dirPath = self.logDir + f"/{self.user_name}/ERROR"
-        if not os.path.exists(dirPath):
-            os.makedirs(dirPath)
-        # 日志文件路径
-        logFile = os.path.join(dirPath, f"{self.outputFileName}.log")
-        # 移除旧处理器
-        logger.remove()
-        # 添加文件处理器
-        logger.add(logFile,
-                   level='ERROR',
-                   rotation=self.rotation,  # 轮转大小条件
-                   compression=self.compression,  # 日志文件压缩格式
-                   retention=self.retention,
-                   encoding="utf-8",
-                   format='{time:YYYY-MM-DD HH:mm:ss.sss} | {level} | {message}')
-        # 添加控制台输出
-        logger.add(sys.stdout, level='ERROR', format='{time:YYYY-MM-DD HH:mm:ss.sss} | {level} | {message}')
-        # 记录日志
-        logger.error(f"{printStr}\n")
\ No newline at end of file
+        self._log('ERROR', printStr, True)
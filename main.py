@@ -1,9 +1,12 @@
 from datetime import datetime
 import gradio as gr
 
+from agent.ConversationMemory import ConversationMemory
 from agent.workflow import WorkFlow
+from db.ResponseCache import ResponseCache
 from db.SQLiteDB import SQLiteDB
 from log.logger import Logger
+from utils.Tracer import tracer
 
 title = "健康食谱助手"
 description = """🍲 <h1>健康食谱助手</h1>
@@ -18,6 +21,16 @@ examples = [
     ["我应该补充什么营养", None]
 ]
 style_options = ["轻松", "幽默", "正式"]
+# 同时处理的请求数上限（predict 为异步函数，等待模型时不占用队列线程）
+max_concurrency = 16
+# 是否把回答逐字流式输出到聊天框
+stream_response = True
+# 请求追踪：启用后每个请求的节点、模型调用和SQL耗时写入 trace_log，指标写入 metrics_file
+enable_tracing = False
+trace_log = "log/trace.jsonl"
+metrics_file = "log/metrics.prom"
+# 大于0时在该端口提供 Prometheus 的 /metrics 接口
+metrics_port = 0
 
 # CSS样式
 custom_css = """
@@ -99,8 +112,17 @@ custom_css = """
 }
 """
 
-# 修改后的预测函数，加入用户输入的用户名参数
-def predict(message, history, style, input_username):
+def style_prefix(style):
+    if style == "幽默":
+        return "哎嘛~ "
+    elif style == "正式":
+        return "尊敬的用户，"
+    else:
+        return "嘿嘿~ "
+
+
+# 修改后的预测函数，加入用户输入的用户名参数（异步生成器，逐步返回聊天记录）
+async def predict(message, history, style, input_username):
     global user_name, sqLite
     user_name = input_username.strip()  # 去掉首尾空格
 
@@ -108,12 +130,14 @@ def predict(message, history, style, input_username):
         # 如果用户名为空，提醒用户输入
         history = history or []
         history.append((message, "⚠️ 请先填写用户名再开始对话哦~"))
-        return history, ""  # 返回历史记录和空字符串清空输入框
+        yield history, ""  # 返回历史记录和空字符串清空输入框
+        return
     
     # 检查用户是否存在，如果不存在则自动注册
     user_info = sqLite.get_user_by_name(user_name)
     is_new_user = False
-    
+    user_id = user_info["user_id"] if user_info else None
+
     if not user_info:
         # 用户不存在，自动注册
         user_id = sqLite.register_user(user_name)
@@ -124,7 +148,8 @@ def predict(message, history, style, input_username):
             print(f"创建用户 {user_name} 失败")
             history = history or []
             history.append((message, "⚠️ 创建用户失败，请尝试使用其他用户名。"))
-            return history, ""  # 返回历史记录和空字符串清空输入框
+            yield history, ""  # 返回历史记录和空字符串清空输入框
+            return
     
     dictionary = {'prompt': message}
     print(dictionary)
@@ -146,33 +171,41 @@ def predict(message, history, style, input_username):
         
         # 如果是欢迎消息，就直接返回，不进行后续处理
         if not message:
-            return history, ""  # 返回历史记录和空字符串清空输入框
+            yield history, ""  # 返回历史记录和空字符串清空输入框
+            return
 
     history = history[-20:]
-    model_input = []
-    for chat in history:
-        model_input.append({"role": "user", "content": chat[0]})
-        model_input.append({"role": "assistant", "content": chat[1]})
-    model_input.append({"role": "user", "content": message})
-    print(model_input)
-
+    # 对话上下文由 WorkFlow 的 ConversationMemory 在服务端维护，这里只负责界面显示
     try:
-        user_name, response = workflow.run({"require": message, "user_name": user_name})
-        print(response)
+        # 用户已经在上面确定，工作流直接使用 user_id，不需要再查询或调用大模型判断登录
+        input = {"require": message, "user_name": user_name, "user_id": user_id, "style": style}
+        prefix = style_prefix(style)
 
-        if style == "幽默":
-            response = "哎嘛~ " + response
-        elif style == "正式":
-            response = "尊敬的用户，" + response
-        else:
-            response = "嘿嘿~ " + response
+        if not stream_response:
+            user_name, response = await workflow.arun(input)
+            print(response)
+            history.append((message, prefix + response))
+            yield history, ""  # 返回历史记录和空字符串清空输入框
+            return
 
-        history.append((message, response))
-        return history, ""  # 返回历史记录和空字符串清空输入框
+        # 先输出风格前缀，之后随 conclude 的输出逐步更新最后一条回答
+        response = ""
+        history.append((message, prefix))
+        yield history, ""
+        async for event in workflow.astream(input):
+            if event["type"] == "token":
+                response += event["text"]
+            else:
+                user_name, response = event["user_name"], event["message"]
+                print(response)
+            history[-1] = (message, prefix + response)
+            yield history, ""
     except Exception as e:
-        print(f"workflow.run 方法执行出错: {e}")
+        print(f"workflow 执行出错: {e}")
+        if history and history[-1][0] == message:
+            history.pop()
         history.append((message, "很抱歉！宕机了！"))
-        return history, ""  # 返回历史记录和空字符串清空输入框
+        yield history, ""  # 返回历史记录和空字符串清空输入框
 
 
 # 构建 Gradio 页面
@@ -259,7 +292,7 @@ with gr.Blocks(title=title, theme=gr.themes.Soft(
     )
 
     # 确保在launch()之前启用队列
-    demo.queue()
+    demo.queue(concurrency_count=max_concurrency)
 
 
 if __name__ == "__main__":
@@ -267,5 +300,10 @@ if __name__ == "__main__":
     timestamp = datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
     logger = Logger(f"test_{timestamp}_gty")
     user_name = ""  # 初始为空，由用户输入
-    workflow = WorkFlow(sqLite, logger)
+    if enable_tracing:
+        tracer.configure(jsonl_path=trace_log, metrics_path=metrics_file)
+        if metrics_port:
+            tracer.serve_metrics(metrics_port)
+    workflow = WorkFlow(sqLite, logger, response_cache=ResponseCache(), max_concurrency=max_concurrency,
+                        memory=ConversationMemory())
     demo.launch()
\ No newline at end of file
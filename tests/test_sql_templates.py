@@ -0,0 +1,58 @@
+import unittest
+from datetime import datetime
+
+from agent.IntentRouter import INTENT_RECORD
+from agent.SqlTemplates import SqlTemplates
+
+NOW = datetime(2025, 6, 18, 12)
+
+
+class FixedCategoryDB:
+    """只提供 resolve_food_category，所有食物都归到同一个类别"""
+
+    def resolve_food_category(self, food_name):
+        return 1
+
+
+class ParseRecordTest(unittest.TestCase):
+
+    def setUp(self):
+        self.templates = SqlTemplates(FixedCategoryDB())
+
+    def items(self, text):
+        plan = self.templates.match(text, INTENT_RECORD, NOW)
+        if plan is None:
+            return None
+        return [(item["meal_type"], item["food_name"]) for item in plan["slots"]["items"]]
+
+    def test_food_after_verb(self):
+        self.assertEqual(self.items("早上八点吃了包子"), [("breakfast", "包子")])
+        self.assertEqual(self.items("晚上在食堂吃了米饭"), [("dinner", "米饭")])
+        self.assertEqual(self.items("午餐在公司吃了牛肉面"), [("lunch", "牛肉面")])
+
+    def test_quantity_is_stripped(self):
+        self.assertEqual(self.items("早上8点吃了两个包子"), [("breakfast", "包子")])
+        self.assertEqual(self.items("中午吃了一碗牛肉面"), [("lunch", "牛肉面")])
+        self.assertEqual(self.items("早餐吃了三明治"), [("breakfast", "三明治")])
+
+    def test_multiple_meals(self):
+        self.assertEqual(
+            self.items("早餐燕麦粥，午餐西红柿炒鸡蛋，晚餐鱼"),
+            [("breakfast", "燕麦粥"), ("lunch", "西红柿炒鸡蛋"), ("dinner", "鱼")]
+        )
+        self.assertEqual(self.items("中午吃了米饭，还喝了豆浆"), [("lunch", "米饭"), ("lunch", "豆浆")])
+
+    def test_not_a_dish_falls_back(self):
+        self.assertIsNone(self.items("早上八点包子"))
+        self.assertIsNone(self.items("中午吃了米饭还喝了汤"))
+
+    def test_not_eaten_falls_back(self):
+        for text in ["今天早餐没吃饭", "午饭不想吃肉", "晚餐打算吃鱼", "明天早餐吃包子", "早餐吃了面包，明天午餐吃米饭"]:
+            self.assertIsNone(self.items(text), text)
+
+    def test_invalid_date_falls_back(self):
+        self.assertIsNone(self.items("2月30日早餐吃了包子"))
+
+
+if __name__ == "__main__":
+    unittest.main()
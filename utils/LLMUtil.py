@@ -1,5 +1,7 @@
 import os
+import threading
 from typing import TypedDict, Annotated   # 用于定义类型结构, Annotated用于添加元数据
+import httpx
 from langchain_core.language_models import BaseChatModel # 用于定义语言模型
 from langchain_openai import ChatOpenAI 
 from langgraph.graph.message import AnyMessage, add_messages # 用于定义消息结构
@@ -14,8 +16,15 @@ class AgentState(TypedDict):
     
     包含以下字段：
     - user_name: 用户名（字符串）
+    - user_id: 当前用户的ID（整数，未登录时为None），SQL中直接使用，不再通过用户名子查询
     - require: 用户输入的原始需求（字符串）
+    - style: 回复风格（字符串，参与回答缓存的键）
+    - history: 该用户之前的对话上下文（字符串，由 ConversationMemory 生成，可能为空）
     - judge_result: 需求判断结果（字符串）
+    - intent: 本地意图路由判断出的意图（record/query/advice/login）
+    - intent_confidence: 意图判断的置信度
+    - intent_source: 意图判断的来源（rule/model/llm）
+    - sql_plan: 命中确定性SQL模板时提取出的槽位（字典，未命中为None）
     - list_tables_tool_result: 表列表工具执行结果（字符串）
     - get_schema_tool_result: 表结构工具执行结果（字符串）
     - sql_and_result: SQL语句和执行结果列表（字典列表）
@@ -23,8 +32,15 @@ class AgentState(TypedDict):
     - tool_feedback: 工具反馈列表（字符串列表）
     """
     user_name: str
+    user_id: int
     require: str
+    style: str
+    history: str
     judge_result: str
+    intent: str
+    intent_confidence: float
+    intent_source: str
+    sql_plan: dict
     list_tables_tool_result: str
     get_schema_tool_result: str
     sql_and_result: list[dict[str, str]]
@@ -57,7 +73,20 @@ def get_prompt_file(filename):
     return prompt_file
 
 
-def get_new_llm():
+# 模型配置，每个配置在 ModelRegistry 中只创建一个客户端
+MODEL_CONFIGS = {
+    "default": {
+        "model_name": "qwen-max",  # 使用通义千问模型
+        "temperature": 0,  # 温度参数设为0，输出稳定
+        "streaming": True,  # 启用流式输出（逐字符返回结果）
+        "stream_usage": True,  # 流式输出时也返回token用量（用于 utils.Tracer 统计）
+        "openai_api_key": "",  # 替换为实际的API密钥
+        "openai_api_base": ""  # 替换为实际的API端点
+    }
+}
+
+
+def get_new_llm(name: str = "default", **kwargs):
     """
     创建并返回一个新的语言模型实例
     
@@ -70,13 +99,66 @@ def get_new_llm():
         3. 启用流式输出（逐字符返回结果）
         4. 配置DashScope兼容模式的API密钥和端点
     """
-    return ChatOpenAI(
-        model_name="qwen-max",  # 使用通义千问模型
-        temperature=0,  # 温度参数设为0，输出稳定
-        streaming=True,  # 启用流式输出（逐字符返回结果）
-        openai_api_key="",  # 替换为实际的API密钥
-        openai_api_base=""  # 替换为实际的API端点
-    )
+    return ChatOpenAI(**MODEL_CONFIGS[name], **kwargs)
+
+
+class ModelRegistry:
+    """
+    共享的模型客户端注册表
+
+    每个模型配置只创建一个 ChatOpenAI 实例，所有实例共用一个保持长连接的HTTP连接池
+    （同步和异步各一个），绑定工具后的模型也按名称缓存，避免每个节点、每次请求
+    重新构造客户端和重新握手。创建过程加锁，可以在 Gradio 的多个工作线程间共享。
+    """
+
+    def __init__(self, max_connections: int = 20, max_keepalive_connections: int = 10, timeout: float = 120.0):
+        self._lock = threading.Lock()
+        self._models = {}
+        self._bound = {}
+        limits = httpx.Limits(max_connections=max_connections,
+                              max_keepalive_connections=max_keepalive_connections)
+        self.http_client = httpx.Client(limits=limits, timeout=timeout)
+        self.http_async_client = httpx.AsyncClient(limits=limits, timeout=timeout)
+
+    def get(self, name: str = "default"):
+        """获取指定配置的共享模型实例"""
+        model = self._models.get(name)
+        if model is None:
+            with self._lock:
+                model = self._models.get(name)
+                if model is None:
+                    model = get_new_llm(name, http_client=self.http_client,
+                                        http_async_client=self.http_async_client)
+                    self._models[name] = model
+        return model
+
+    def bind_tools(self, key: str, tools: list, name: str = "default", **kwargs):
+        """
+        获取绑定了工具的共享模型
+
+        参数:
+            key (str): 绑定结果的缓存名称（如"query_gen"）
+            tools (list): 需要绑定的工具
+            name (str): 模型配置名称
+            **kwargs: 传给 bind_tools 的其他参数（如 tool_choice）
+        """
+        bound = self._bound.get((name, key))
+        if bound is None:
+            model = self.get(name)
+            with self._lock:
+                bound = self._bound.get((name, key))
+                if bound is None:
+                    bound = model.bind_tools(tools, **kwargs)
+                    self._bound[(name, key)] = bound
+        return bound
+
+
+model_registry = ModelRegistry()
+
+
+def get_llm(name: str = "default"):
+    """获取共享的语言模型实例（见 ModelRegistry）"""
+    return model_registry.get(name)
 
 
 def get_llm_chain(llm: BaseChatModel, prompt_file: str, useStrOutputParser: bool = False, **kwargs):
@@ -115,4 +197,26 @@ def get_llm_chain(llm: BaseChatModel, prompt_file: str, useStrOutputParser: bool
             try_num += 1
         return answer
     else:
-        return agent.run()
\ No newline at end of file
+        return agent.run()
+
+
+async def aget_llm_chain(llm: BaseChatModel, prompt_file: str, useStrOutputParser: bool = False, **kwargs):
+    """
+    get_llm_chain 的异步版本，参数和返回值相同
+    """
+    agent = LlmChainGenerate(
+        llm=llm,
+        prompt_file=prompt_file,
+        useStrOutputParser=useStrOutputParser,
+        **kwargs
+    )
+
+    if useStrOutputParser:
+        answer = ''
+        try_num = 0
+        while len(answer) < 5 and try_num < 2:
+            answer = await agent.arun()
+            try_num += 1
+        return answer
+    else:
+        return await agent.arun()
@@ -0,0 +1,169 @@
+import glob
+import os
+import re
+import threading
+import time
+
+from langchain_core.prompts import ChatPromptTemplate, HumanMessagePromptTemplate, SystemMessagePromptTemplate
+
+PROMPT_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "prompts"))
+# <name>.system.txt 是 <name>.txt 的固定前缀，作为 system 消息放在最前面
+SYSTEM_SUFFIX = ".system.txt"
+CJK_PATTERN = re.compile(r"[\u4e00-\u9fff\u3000-\u303f\uff00-\uffef]")
+
+
+def estimate_tokens(text):
+    """粗略估算 token 数：中文字符和全角标点按1个计算，其他字符按4个字符1个计算"""
+    if not text:
+        return 0
+    cjk = len(CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def prompt_size(messages):
+    """
+    估算一次模型调用的提示词大小
+
+    参数:
+        messages (list): 发送给模型的消息列表
+
+    返回:
+        tuple: (固定前缀即 system 消息的 token 数, 其余随请求变化部分的 token 数)
+    """
+    prefix = request = 0
+    for message in messages:
+        tokens = estimate_tokens(str(message.content))
+        if getattr(message, "type", None) == "system":
+            prefix += tokens
+        else:
+            request += tokens
+    return prefix, request
+
+
+class PromptRegistry:
+    """
+    提示词模板注册表
+
+    启动时一次性读取并编译 prompts/ 下的所有模板，之后从内存提供。
+    每隔 check_interval 秒最多检查一次文件的修改时间，文件被修改时自动重新加载，
+    不需要重启服务。注册了期望变量的模板在重新加载时会先校验，
+    变量不匹配的新版本不会生效，继续使用旧模板。
+
+    <name>.txt 旁边存在 <name>.system.txt 时，后者作为 system 消息放在前面。system 部分不允许包含变量，
+    每次请求的内容完全相同，模型服务的前缀缓存（prompt caching）可以命中，只有 <name>.txt 渲染出的
+    human 消息随请求变化。
+    """
+
+    def __init__(self, prompt_dir: str = PROMPT_DIR, check_interval: float = 1.0):
+        self.prompt_dir = prompt_dir
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._templates = {}  # 路径 -> (模板, 修改时间, 上次检查时间)
+        self._expected = {}   # 路径 -> 期望的变量集合
+        self.load_all()
+
+    def _key(self, prompt_file: str) -> str:
+        if not os.path.isabs(prompt_file) and not os.path.dirname(prompt_file):
+            prompt_file = os.path.join(self.prompt_dir, prompt_file)
+        return os.path.normpath(os.path.abspath(prompt_file))
+
+    @staticmethod
+    def _system_path(path: str) -> str:
+        return path[:-len(".txt")] + SYSTEM_SUFFIX
+
+    def _mtime(self, key: str):
+        system_path = self._system_path(key)
+        return os.path.getmtime(key), os.path.getmtime(system_path) if os.path.exists(system_path) else None
+
+    def _compile(self, path: str) -> ChatPromptTemplate:
+        messages = []
+        system_path = self._system_path(path)
+        if os.path.exists(system_path):
+            with open(system_path, 'r', encoding='utf-8') as f:
+                system_prompt = SystemMessagePromptTemplate.from_template(f.read())
+            if system_prompt.input_variables:
+                raise ValueError(f"{system_path} 是固定前缀，不能包含变量 {sorted(system_prompt.input_variables)}")
+            messages.append(system_prompt)
+        with open(path, 'r', encoding='utf-8') as f:
+            # 从文件内容创建人类消息模板，再创建聊天提示模板
+            messages.append(HumanMessagePromptTemplate.from_template(f.read()))
+        return ChatPromptTemplate.from_messages(messages)
+
+    def _load(self, key: str, now: float):
+        mtime = self._mtime(key)
+        try:
+            template = self._compile(key)
+        except ValueError as e:
+            old = self._templates.get(key)
+            if old is None:
+                raise
+            print(f"{e}，继续使用旧模板")
+            self._templates[key] = (old[0], mtime, now)
+            return old[0]
+        expected = self._expected.get(key)
+        if expected is not None and set(template.input_variables) != expected:
+            old = self._templates.get(key)
+            if old is not None:
+                print(f"提示词模板 {key} 的变量 {sorted(template.input_variables)} 与期望的 "
+                      f"{sorted(expected)} 不一致，继续使用旧模板")
+                self._templates[key] = (old[0], mtime, now)
+                return old[0]
+        self._templates[key] = (template, mtime, now)
+        return template
+
+    def load_all(self):
+        now = time.monotonic()
+        with self._lock:
+            for path in glob.glob(os.path.join(self.prompt_dir, "*.txt")):
+                if path.endswith(SYSTEM_SUFFIX):
+                    continue
+                self._load(self._key(path), now)
+
+    def get(self, prompt_file: str) -> ChatPromptTemplate:
+        """
+        获取编译好的提示词模板
+
+        参数:
+            prompt_file (str): 提示文件路径或 prompts/ 下的文件名
+        """
+        key = self._key(prompt_file)
+        now = time.monotonic()
+        entry = self._templates.get(key)
+        if entry is not None and now - entry[2] < self.check_interval:
+            return entry[0]
+        with self._lock:
+            entry = self._templates.get(key)
+            if entry is None or self._mtime(key) != entry[1]:
+                return self._load(key, now)
+            self._templates[key] = (entry[0], entry[1], now)
+            return entry[0]
+
+    def variables(self, prompt_file: str) -> set:
+        return set(self.get(prompt_file).input_variables)
+
+    def validate(self, expected: dict):
+        """
+        校验模板变量与调用方传入的参数是否一致，并登记为热加载时的校验条件
+
+        参数:
+            expected (dict): 文件名 -> 调用方会传入的变量集合
+
+        异常:
+            ValueError: 存在缺失或多余的变量
+        """
+        errors = []
+        for prompt_file, variables in expected.items():
+            key = self._key(prompt_file)
+            self._expected[key] = set(variables)
+            actual = self.variables(key)
+            missing = actual - set(variables)
+            unused = set(variables) - actual
+            if missing:
+                errors.append(f"{prompt_file} 需要变量 {sorted(missing)}，但调用方没有传入")
+            if unused:
+                errors.append(f"{prompt_file} 没有使用变量 {sorted(unused)}")
+        if errors:
+            raise ValueError("提示词模板校验失败：\n" + "\n".join(errors))
+
+
+prompt_registry = PromptRegistry()
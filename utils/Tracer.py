@@ -0,0 +1,289 @@
+import json
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from collections import defaultdict
+from contextvars import ContextVar
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from utils.PromptRegistry import prompt_size
+
+# 当前请求ID，由 WorkFlow 在执行工作流前设置，节点和工具内部记录SQL时读取
+current_request_id = ContextVar("current_request_id", default=None)
+
+# 耗时直方图的分桶上限（秒）
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRIC_PREFIX = "healtheat"
+
+
+class Histogram:
+    """Prometheus 风格的累积直方图"""
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f"{name}_bucket{_labels(labels, le=le)} {cumulative}")
+        lines.append(f"{name}_sum{_labels(labels)} {self.sum}")
+        lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+        return lines
+
+
+def _labels(labels, **extra):
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{str(value)}"' for key, value in items) + "}"
+
+
+class Tracer(BaseCallbackHandler):
+    """
+    工作流的请求追踪和指标
+
+    作为 LangChain 回调挂到工作流上（见 WorkFlow.callbacks），记录：
+    - 每个请求的总耗时（request）
+    - 每个节点的耗时（node）
+    - 每次模型调用的耗时、输入/输出 token 数、命中前缀缓存的 token 数，
+      以及估算的提示词大小（固定前缀 / 随请求变化的部分）（llm）
+    - 每条SQL的执行耗时和行数（sql，由执行SQL的代码调用 record_sql）
+    每条记录都带有请求ID，以JSONL格式写入 jsonl_path，同时汇总为 Prometheus 文本格式的指标，
+    可以写入 metrics_path 或通过 serve_metrics() 提供 HTTP 接口。
+    enabled 为False时 WorkFlow 不挂载回调，record_sql 直接返回，几乎没有额外开销。
+    """
+
+    def __init__(self, enabled=False, jsonl_path=None, metrics_path=None):
+        self.enabled = enabled
+        self.jsonl_path = jsonl_path
+        self.metrics_path = metrics_path
+        self._lock = threading.Lock()
+        self._file = None
+        self._runs = {}  # run_id -> (类型, 名称, 请求ID, 开始时间)
+        self._histograms = defaultdict(Histogram)
+        self._counters = defaultdict(float)
+        self._server = None
+
+    def configure(self, enabled=True, jsonl_path=None, metrics_path=None):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self.enabled = enabled
+            self.jsonl_path = jsonl_path
+            self.metrics_path = metrics_path
+        return self
+
+    @staticmethod
+    def new_request_id():
+        return uuid.uuid4().hex[:16]
+
+    # ---- 记录 ----
+
+    def _emit(self, event):
+        if self.jsonl_path is None:
+            return
+        event["ts"] = datetime.now().isoformat(timespec="milliseconds")
+        line = json.dumps(event, ensure_ascii=False)
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.jsonl_path, "a", encoding="utf-8", buffering=1)
+            self._file.write(line + "\n")
+
+    def _observe(self, metric, labels, seconds):
+        with self._lock:
+            self._histograms[(metric, labels)].observe(seconds)
+
+    def _count(self, metric, labels, value=1):
+        with self._lock:
+            self._counters[(metric, labels)] += value
+
+    def record_sql(self, statement, seconds, rows, source="db_query_tool"):
+        """
+        记录一条SQL的执行情况
+
+        参数:
+            statement (str): SQL语句
+            seconds (float): 执行耗时
+            rows (int): 返回或受影响的行数
+            source (str): 执行SQL的位置（db_query_tool / template）
+        """
+        if not self.enabled:
+            return
+        labels = (("source", source),)
+        self._observe("sql_duration_seconds", labels, seconds)
+        self._count("sql_rows_total", labels, rows)
+        self._emit({
+            "type": "sql", "request_id": current_request_id.get(), "name": source,
+            "duration_ms": round(seconds * 1000, 3), "rows": rows, "statement": statement,
+        })
+
+    # ---- LangChain 回调 ----
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        metadata = metadata or {}
+        request_id = metadata.get("request_id")
+        if parent_run_id is None:
+            self._runs[run_id] = ("request", "workflow", request_id, time.perf_counter())
+            return
+        node = metadata.get("langgraph_node")
+        # 节点内部的子链也带有相同的 langgraph_node，只记录最外层
+        if not node or node.startswith("__") or kwargs.get("name") != node:
+            return
+        parent = self._runs.get(parent_run_id)
+        if parent is not None and parent[0] == "node":
+            return
+        self._runs[run_id] = ("node", node, request_id, time.perf_counter())
+
+    def _finish_chain(self, run_id, error=None):
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        kind, name, request_id, start = run
+        seconds = time.perf_counter() - start
+        if kind == "request":
+            self._observe("request_duration_seconds", (), seconds)
+            self._count("requests_total", (("status", "error" if error else "ok"),))
+        else:
+            self._observe("node_duration_seconds", (("node", name),), seconds)
+            if error:
+                self._count("node_errors_total", (("node", name),))
+        event = {"type": kind, "request_id": request_id, "name": name, "duration_ms": round(seconds * 1000, 3)}
+        if error:
+            event["error"] = repr(error)
+        self._emit(event)
+        if kind == "request" and self.metrics_path:
+            self.write_metrics(self.metrics_path)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._finish_chain(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._finish_chain(run_id, error)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        metadata = metadata or {}
+        prefix_tokens, request_tokens = prompt_size(messages[0] if messages else [])
+        self._runs[run_id] = ("llm", metadata.get("langgraph_node", ""), metadata.get("request_id"),
+                              time.perf_counter(), prefix_tokens, request_tokens)
+
+    @staticmethod
+    def _token_usage(response):
+        """返回 (输入token数, 输出token数, 命中前缀缓存的输入token数)"""
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    cached = (usage.get("input_token_details") or {}).get("cache_read", 0)
+                    return usage.get("input_tokens", 0), usage.get("output_tokens", 0), cached
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+        return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0), cached
+
+    def _finish_llm(self, run_id, response=None, error=None):
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        _, node, request_id, start, prefix_tokens, request_tokens = run
+        seconds = time.perf_counter() - start
+        labels = (("node", node),)
+        self._observe("llm_duration_seconds", labels, seconds)
+        self._count("llm_prompt_prefix_tokens_total", labels, prefix_tokens)
+        self._count("llm_prompt_request_tokens_total", labels, request_tokens)
+        event = {"type": "llm", "request_id": request_id, "name": node, "duration_ms": round(seconds * 1000, 3),
+                 "prompt_prefix_tokens": prefix_tokens, "prompt_request_tokens": request_tokens}
+        if response is not None:
+            input_tokens, output_tokens, cached_tokens = self._token_usage(response)
+            self._count("llm_input_tokens_total", labels, input_tokens)
+            self._count("llm_output_tokens_total", labels, output_tokens)
+            self._count("llm_cached_input_tokens_total", labels, cached_tokens)
+            event.update(input_tokens=input_tokens, output_tokens=output_tokens, cached_tokens=cached_tokens)
+        if error is not None:
+            self._count("llm_errors_total", labels)
+            event["error"] = repr(error)
+        self._emit(event)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._finish_llm(run_id, response=response)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._finish_llm(run_id, error=error)
+
+    # ---- 导出 ----
+
+    def render_metrics(self):
+        """返回 Prometheus 文本格式的指标"""
+        lines = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+        declared = set()
+        for (metric, labels), histogram in histograms:
+            name = f"{METRIC_PREFIX}_{metric}"
+            if name not in declared:
+                lines.append(f"# TYPE {name} histogram")
+                declared.add(name)
+            lines.extend(histogram.render(name, labels))
+        for (metric, labels), value in counters:
+            name = f"{METRIC_PREFIX}_{metric}"
+            if name not in declared:
+                lines.append(f"# TYPE {name} counter")
+                declared.add(name)
+            lines.append(f"{name}{_labels(labels)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def write_metrics(self, path):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render_metrics())
+        # 先写临时文件再替换，采集方不会读到写了一半的文件
+        os.replace(tmp_path, path)
+
+    def serve_metrics(self, port, host="0.0.0.0"):
+        """在后台线程中启动 /metrics HTTP 接口"""
+        tracer = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = tracer.render_metrics().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self._server
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
+
+
+tracer = Tracer()